@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+#
+# benchmarks for tsviz.
+#
+# run with: python3 benchmarks.py
+#
+# results are printed as JSON. use --suite synthetic --files N to time
+# every phase of the pipeline on a generated repository of N modules.
+#
+
+from argparse import ArgumentParser
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import tsviz
+
+
+def get_header_source(imports=20):
+    # a typical module: an import-block, followed by some code.
+    lines = []
+    for i in range(imports):
+        lines.append("import {{ Class{0} }} from \"./module{0}\";".format(i))
+    lines.append("")
+    lines.append("export class Component {")
+    for i in range(imports):
+        lines.append("    private field{0} = new Class{0}(\"value\", 'value', `value`);".format(i))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def get_large_source(lines=5000):
+    # a large module with few imports, and lots of code, strings and comments.
+    result = [
+        "import { A } from \"./a\";",
+        "const b = require('./b');",
+    ]
+    for i in range(lines):
+        if i % 10 == 0:
+            result.append("// comment mentioning import x from \"./nothing\";")
+        elif i % 10 == 1:
+            result.append("const rx{0} = /import '.*'/g;".format(i))
+        elif i % 10 == 2:
+            result.append("const t{0} = `template ${{a + {0}}} text`;".format(i))
+        else:
+            result.append("function f{0}(a, b) {{ return a / b + \"{0}\"; }}".format(i))
+    return "\n".join(result)
+
+
+def scan_lines(source):
+    # the line-based parser tsviz used before scan_module_specifiers().
+    references = []
+    for line in source.split("\n"):
+        if line.startswith("import "):
+            references.append(line)
+        if line.find("require("):
+            references.append(line)
+
+    result = []
+    for line in references:
+        match = tsviz.module_import_declaration.match(line)
+        if match:
+            result.append(match.groups()[0])
+        match = tsviz.module_require_declaration.match(line)
+        if match:
+            result.append(match.groups()[0])
+    return result
+
+
+def get_corpus_sources(root_dir):
+    sources = []
+    for path, subdirs, files in os.walk(root_dir):
+        for name in files:
+            if name.endswith(".ts") or name.endswith(".js"):
+                with open(os.path.join(path, name), "rb") as f:
+                    data = f.read()
+                try:
+                    sources.append(tsviz.get_source_from_bytes(data))
+                except UnicodeDecodeError:
+                    pass
+    return sources
+
+
+def time_call(function, repeat=5, number=None):
+    # best time per call, in seconds.
+    timer = timeit.Timer(function)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_lexer(corpus_dir=None):
+    sources = {
+        "header": [get_header_source()],
+        "large": [get_large_source()],
+    }
+    if corpus_dir:
+        sources["corpus"] = get_corpus_sources(corpus_dir)
+
+    results = {}
+    for name, items in sources.items():
+        results[name] = {
+            "files": len(items),
+            "bytes": sum(len(source) for source in items),
+            "lines": time_call(lambda: [scan_lines(source) for source in items]),
+            "lexer": time_call(lambda: [tsviz.scan_module_specifiers(source) for source in items]),
+            "lexer_strict": time_call(lambda: [tsviz.scan_module_specifiers(source, strict=True) for source in items]),
+        }
+    return results
+
+
+def get_synthetic_module_path(index, depth):
+    # spread modules over a tree of directories, depth levels deep.
+    dirs = ["d{0}".format((index >> (3 * level)) % 8) for level in range(depth)]
+    return "/".join(["src"] + dirs + ["module{0}.ts".format(index)])
+
+
+def get_relative_specifier(source_path, target_path):
+    specifier = os.path.relpath(target_path, os.path.dirname(source_path)).replace(os.sep, "/")
+    if not specifier.startswith("."):
+        specifier = "./" + specifier
+    return specifier[:-len(".ts")]
+
+
+def generate_synthetic_repository(root_dir, files=1000, fan_out=5, depth=3, cycle_density=0.01, require_ratio=0.2, missing_ratio=0.01, seed=0):
+    """
+    Writes a synthetic typescript-project to root_dir.
+
+    Every module imports fan_out other modules. Imports normally point to
+    modules with a higher index, so the graph is acyclic, except for the
+    cycle_density fraction pointing backwards. require_ratio of the imports
+    use require(), and missing_ratio of them point to modules which don't
+    exist. Returns the number of imports written.
+    """
+    rng = random.Random(seed)
+    paths = [get_synthetic_module_path(index, depth) for index in range(files)]
+    imports = 0
+
+    for index, path in enumerate(paths):
+        lines = []
+        for n in range(min(fan_out, files - 1)):
+            if rng.random() < missing_ratio:
+                target = "src/missing{0}.ts".format(rng.randrange(files))
+            elif index == files - 1 or rng.random() < cycle_density:
+                target = paths[rng.randrange(index + 1)]
+            else:
+                target = paths[rng.randrange(index + 1, files)]
+
+            specifier = get_relative_specifier(path, target)
+            if rng.random() < require_ratio:
+                lines.append("const dep{0} = require(\"{1}\");".format(n, specifier))
+            else:
+                lines.append("import {{ Dep{0} }} from \"{1}\";".format(n, specifier))
+            imports += 1
+
+        lines.append("")
+        lines.append("export class Module{0} {{".format(index))
+        lines.append("    // some code, which the parser has to skip.")
+        lines.append("    private name = \"module{0}\";".format(index))
+        lines.append("    public run(a: number, b: number) {{ return a / b + `${{this.name}}`; }}")
+        lines.append("}")
+
+        filename = os.path.join(root_dir, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write("\n".join(lines))
+
+    return imports
+
+
+def bench_pipeline(root_dir, jobs=1, highlight=".*module1.*"):
+    """
+    Runs every phase of the tsviz pipeline once on root_dir, and returns
+    the seconds spent in each.
+    """
+    timings = {}
+
+    def timed(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    tsviz.extension = ".ts"
+    tsviz.set_working_basedir(root_dir)
+
+    # tsviz reports cycles and missing modules on stdout.
+    with contextlib.redirect_stdout(io.StringIO()):
+        files = timed("get_tsfiles_in_dir", tsviz.get_tsfiles_in_dir, root_dir)
+        modules = tsviz.get_modules(files)
+        timed("read_module_specifiers", tsviz.apply_declared_module_dependencies, modules, jobs)
+        graph = timed("process_modules", tsviz.process_modules, modules)
+        reachability = graph.get_reachability()
+        timed("remove_transitive_dependencies", tsviz.remove_transitive_dependencies, modules, graph)
+        timed("highlight_modules", tsviz.highlight_modules, re.compile(highlight), modules, reachability)
+        timed("render_dot_file", tsviz.render_dot_file, modules, True, False, reachability)
+
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+def bench_watch(root_dir):
+    """
+    Times Watcher.update() on root_dir after editing one file, without
+    and with changing its imports.
+    """
+    filename = os.path.join(root_dir, get_synthetic_module_path(0, 3))
+    with open(filename) as f:
+        source = f.read()
+
+    def edit(txt):
+        with open(filename, "w") as f:
+            f.write(txt)
+        watcher.scan()
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        watcher = tsviz.Watcher(root_dir, os.path.join(root_dir, "graph.dot"))
+        watcher.scan()
+        watcher.update()
+        try:
+            edit(source + "\n// edited\n")
+            start = time.perf_counter()
+            watcher.update()
+            timings["watch_same_imports"] = time.perf_counter() - start
+
+            edit("import { X } from \"./added\";\n" + source)
+            start = time.perf_counter()
+            watcher.update()
+            timings["watch_changed_imports"] = time.perf_counter() - start
+        finally:
+            with open(filename, "w") as f:
+                f.write(source)
+            os.remove(os.path.join(root_dir, "graph.dot"))
+    return timings
+
+
+def bench_synthetic(files=1000, fan_out=5, depth=3, cycle_density=0.01, require_ratio=0.2, missing_ratio=0.01, seed=0, jobs=1, repeat=3, directory=None):
+    parameters = {
+        "files": files,
+        "fan_out": fan_out,
+        "depth": depth,
+        "cycle_density": cycle_density,
+        "require_ratio": require_ratio,
+        "missing_ratio": missing_ratio,
+        "seed": seed,
+        "jobs": jobs,
+    }
+
+    root_dir = directory or tempfile.mkdtemp(prefix="tsviz-bench-")
+    try:
+        imports = generate_synthetic_repository(root_dir, files, fan_out, depth, cycle_density, require_ratio, missing_ratio, seed)
+
+        # best time per phase.
+        phases = {}
+        for i in range(repeat):
+            results = bench_pipeline(root_dir, jobs)
+            results.update(bench_watch(root_dir))
+            for name, seconds in results.items():
+                phases[name] = min(seconds, phases.get(name, seconds))
+    finally:
+        if directory is None:
+            shutil.rmtree(root_dir)
+
+    return {
+        "parameters": parameters,
+        "imports": imports,
+        "seconds": phases,
+    }
+
+
+def measure_graph_memory(files, fan_out, depth=3, seed=0):
+    # bytes allocated by a resolved graph of files modules, built in memory.
+    rng = random.Random(seed)
+    paths = ["/repo/" + get_synthetic_module_path(index, depth) for index in range(files)]
+
+    # the specifiers a parser would have returned.
+    specifiers = [
+        [get_relative_specifier(path, paths[rng.randrange(files)]) for n in range(fan_out)]
+        for path in paths
+    ]
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            modules = tsviz.get_modules(paths, "/repo")
+            for module, module_specifiers in zip(modules, specifiers):
+                module.apply_module_specifiers(module_specifiers)
+            graph = tsviz.process_modules(modules, base_path="/repo")
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    edges = sum(len(module.declared_dependant_modules) for module in modules)
+    del graph, modules
+    return after - before, edges
+
+
+def bench_memory(files=10000, fan_out=5, depth=3, seed=0):
+    """
+    Measures the memory used per module and per import-edge by a resolved
+    module-graph, including its DependencyGraph.
+    """
+    empty, _ = measure_graph_memory(files, 0, depth, seed)
+    total, edges = measure_graph_memory(files, fan_out, depth, seed)
+    return {
+        "parameters": {"files": files, "fan_out": fan_out, "depth": depth, "seed": seed},
+        "edges": edges,
+        "bytes": total,
+        "bytes_per_module": empty / files,
+        "bytes_per_edge": (total - empty) / edges if edges else None,
+    }
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument("--output", "-o", help="Write results as JSON to this file")
+    p.add_argument("--suite", choices=["all", "lexer", "synthetic", "memory"], default="all", help="Which benchmarks to run")
+    p.add_argument("--lexer-corpus", help="Also benchmark the lexer on the .ts and .js files in this directory")
+    p.add_argument("--files", type=int, default=1000, help="Modules in the synthetic repository")
+    p.add_argument("--fan-out", type=int, default=5, help="Imports per synthetic module")
+    p.add_argument("--depth", type=int, default=3, help="Directory depth of the synthetic repository")
+    p.add_argument("--cycle-density", type=float, default=0.01, help="Fraction of imports pointing backwards, creating cycles")
+    p.add_argument("--require-ratio", type=float, default=0.2, help="Fraction of imports using require()")
+    p.add_argument("--missing-ratio", type=float, default=0.01, help="Fraction of imports pointing to missing modules")
+    p.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic repository")
+    p.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes used to parse files")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per synthetic benchmark. The best time is reported")
+    p.add_argument("--synthetic-dir", help="Generate the synthetic repository here, and keep it")
+    args = p.parse_args()
+
+    results = {}
+    if args.suite in ("all", "lexer"):
+        results["lexer"] = bench_lexer(args.lexer_corpus)
+    if args.suite in ("all", "synthetic"):
+        results["synthetic"] = bench_synthetic(
+            args.files, args.fan_out, args.depth, args.cycle_density, args.require_ratio,
+            args.missing_ratio, args.seed, args.jobs, args.repeat, args.synthetic_dir
+        )
+
+    if args.suite in ("all", "memory"):
+        results["memory"] = bench_memory(args.files, args.fan_out, args.depth, args.seed)
+
+    txt = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(txt)
+    print(txt)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,28 @@
+import io
+import json
 import unittest
 import tsviz
 import re
+import os
+import shutil
+import tempfile
+
+
+def write_files(root, files):
+    for name, contents in files.items():
+        filename = os.path.join(root, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(contents)
 
 
 class Tests(unittest.TestCase):
+    def get_temp_dir(self):
+        # a scratch directory, removed again when the test ends.
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        return root
+
     def test_parse_module_import_regexp(self):
         decl = "import { class } from \"./File\";"
         m = tsviz.module_import_declaration.match(decl)
@@ -26,6 +45,54 @@ class Tests(unittest.TestCase):
         [filename] = m.groups()
         self.assertEqual("./File", filename)
 
+    def test_scan_module_specifiers(self):
+        source = "\n".join([
+            "// import a from \"./commented\";",
+            "import {",
+            "    b,",
+            "    c as d,",
+            "} from \"./multiline\";",
+            "import * as e from './star';",
+            "import \"./side-effect\";",
+            "export * from \"./reexport\";",
+            "export { f } from \"./reexport-named\";",
+            "export class G {",
+            "    h = \"import i from './string'\";",
+            "    j = `${require(\"./template\")} import k from './template-body'`;",
+            "    l = /require('.\\/regexp')/;",
+            "    m = n / o / p;",
+            "    q = import(\"./dynamic\");",
+            "    r = s.require(\"./member\");",
+            "}",
+            "const t = require('./require');",
+            "let u = v++ / 2; import w from \"./after-increment\";",
+            "let x = y-- / 2; import z from \"./after-decrement\";",
+            "aa = `${ab}` / 2; import ac from \"./after-template\";",
+            "ad = \"1\" / 2; import ae from \"./after-string\";",
+        ])
+
+        self.assertEqual([
+            "./multiline", "./star", "./side-effect", "./reexport", "./reexport-named",
+            "./template", "./dynamic", "./require", "./after-increment",
+            "./after-decrement", "./after-template", "./after-string",
+        ], tsviz.scan_module_specifiers(source))
+
+    def test_scan_module_specifiers_strict_stops_after_imports(self):
+        source = "\n".join([
+            "\"use strict\";",
+            "import { a } from \"./a\";",
+            "export * from \"./b\";",
+            "export class C {}",
+            "import { d } from \"./d\";",
+        ])
+
+        self.assertEqual(["./a", "./b"], tsviz.scan_module_specifiers(source, strict=True))
+
+    def test_scan_module_specifiers_handles_typescript_import_require(self):
+        source = "import a = require(\"./a\");\nimport from from \"./b\";"
+
+        self.assertEqual(["./a", "./b"], tsviz.scan_module_specifiers(source))
+
     def test_module_id(self):
         module = tsviz.Module("SuperOffice.Test.Name.ts")
         self.assertEqual("SuperOffice_Test_Name_ts", module.get_friendly_id())
@@ -48,6 +115,80 @@ class Tests(unittest.TestCase):
         # has proper labels
         self.assertEqual(True, "label=\"Module.SO.Main.ts\"" in txt)
 
+    def test_machine_readable_output(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        missing = tsviz.Module("./Missing.ts")
+        missing.is_missing_module = True
+        a.dependant_modules = [b, missing]
+        a.has_missing_modules = True
+        projects = [a, b, missing]
+
+        f = io.StringIO()
+        tsviz.write_jsonl_file(f, projects)
+        items = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual({"type": "node", "id": "./Missing.ts", "highlighted": False, "missing": True, "has_missing": False, "circular": False}, items[2])
+        self.assertEqual({"type": "edge", "source": "./A.ts", "target": "./Missing.ts", "style": "missing"}, items[4])
+        self.assertEqual(5, len(items))
+
+        f = io.StringIO()
+        tsviz.write_csv_file(f, projects)
+        self.assertEqual("source,target,style\n./A.ts,./B.ts,\n./A.ts,./Missing.ts,missing\n", f.getvalue())
+
+        import xml.etree.ElementTree as ET
+        f = io.StringIO()
+        tsviz.write_graphml_file(f, projects)
+        ns = {"g": "http://graphml.graphdrawing.org/xmlns"}
+        graph = ET.fromstring(f.getvalue()).find("g:graph", ns)
+        self.assertEqual(["./A.ts", "./B.ts", "./Missing.ts"], [node.get("id") for node in graph.findall("g:node", ns)])
+        self.assertEqual(2, len(graph.findall("g:edge", ns)))
+
+        # modules importing the same npm-module share its node.
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+        c.add_dependency("react")
+        d.add_dependency("react")
+        projects = [c, d]
+        tsviz.process_modules(projects)
+        self.assertEqual(3, len(projects))
+
+        f = io.StringIO()
+        tsviz.write_graphml_file(f, projects)
+        ids = [node.get("id") for node in ET.fromstring(f.getvalue()).find("g:graph", ns).findall("g:node", ns)]
+        self.assertEqual(sorted(set(ids)), sorted(ids))
+
+        # collapsed graphs are refused before anything is read or written.
+        root = self.get_temp_dir()
+        output = os.path.join(root, "graph.jsonl")
+        with self.assertRaises(ValueError):
+            tsviz.process(os.path.join(root, "missing"), output, None, None, False, False, False, collapse=0, output_format="jsonl")
+        self.assertEqual(False, os.path.exists(output))
+
+    def test_graphviz_output_highlights_all_paths(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+
+        a.add_dependency(b.filename)
+        b.add_dependency(c.filename)
+        a.add_dependency(d.filename)
+        modules = [a, b, c, d]
+        tsviz.process_modules(modules)
+        c.highlight = True
+
+        txt = tsviz.render_dot_file(modules, highlight_all=True)
+        self.assertEqual(True, "__A_ts -> __B_ts [color=\"#30c2c2\"]\n" in txt)
+        self.assertEqual(True, "__B_ts -> __C_ts [color=\"#30c2c2\"]\n" in txt)
+        self.assertEqual(True, "__A_ts -> __D_ts\n" in txt)
+        self.assertEqual(True, txt.endswith("\n}"))
+
+        # same result when streamed, or using a shared reachability index.
+        reachability = tsviz.DependencyGraph(modules, declared=True).get_reachability()
+        f = io.StringIO()
+        tsviz.write_dot_file(f, modules, highlight_all=True, reachability=reachability)
+        self.assertEqual(txt, f.getvalue())
+
     def test_eliminate_dependencies(self):
         a = tsviz.Module("./A.ts")
         b = tsviz.Module("./B.ts")
@@ -66,6 +207,39 @@ class Tests(unittest.TestCase):
         self.assertEqual([c], b.dependant_modules)
         self.assertEqual([d], c.dependant_modules)
 
+    def test_eliminate_dependencies_for_whole_graph(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+
+        a.dependant_modules = [b, c, d]
+        b.dependant_modules = [c, d]
+        c.dependant_modules = [d]
+
+        tsviz.remove_transitive_dependencies([a, b, c, d])
+
+        self.assertEqual([b], a.dependant_modules)
+        self.assertEqual([c], b.dependant_modules)
+        self.assertEqual([d], c.dependant_modules)
+
+    def test_eliminate_dependencies_keeps_circular_dependencies(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+
+        # b and c depend on each other, and both depend on d.
+        a.dependant_modules = [b, c, d]
+        b.dependant_modules = [c, d]
+        c.dependant_modules = [b, d]
+
+        tsviz.remove_transitive_dependencies([a, b, c, d])
+
+        self.assertEqual([b, c], a.dependant_modules)
+        self.assertEqual([c, d], b.dependant_modules)
+        self.assertEqual([b, d], c.dependant_modules)
+
     def test_dependency_chains(self):
         a = tsviz.Module("./A.ts")
         b = tsviz.Module("./B.ts")
@@ -95,6 +269,149 @@ class Tests(unittest.TestCase):
         self.assertEqual(False, b2.has_highlighted_dependencies())
         self.assertEqual(False, c.has_highlighted_dependencies())
 
+    def test_reachability_index(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+
+        a.add_dependency(b.filename)
+        a.add_dependency(c.filename)
+        b.add_dependency(d.filename)
+        c.add_dependency(d.filename)
+
+        graph = tsviz.process_modules([a, b, c, d])
+        reachability = graph.get_reachability()
+
+        self.assertEqual(True, reachability.depends_on(a, d))
+        self.assertEqual(False, reachability.depends_on(d, a))
+        self.assertEqual(False, reachability.depends_on(b, c))
+        self.assertEqual(False, reachability.depends_on(a, a))
+        self.assertEqual(True, reachability.is_dependency_of(d, b))
+
+        self.assertEqual([a, b, d], reachability.get_path(a, d))
+        self.assertEqual(None, reachability.get_path(b, c))
+
+        d.highlight = True
+        self.assertEqual(True, c.has_highlighted_dependencies(reachability))
+        self.assertEqual(False, d.has_highlighted_dependencies(reachability))
+
+    def test_focus_modules(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+        e = tsviz.Module("./E.ts")
+        f = tsviz.Module("./F.ts")
+
+        a.dependant_modules = [b]
+        b.dependant_modules = [c]
+        c.dependant_modules = [d]
+        e.dependant_modules = [b, f]
+        projects = [a, b, c, d, e, f]
+
+        rx = re.compile(r"\./b")
+        self.assertEqual([b, c, d], tsviz.get_neighbourhood(rx, projects, 2, upstream=False))
+        self.assertEqual([a, b, e], tsviz.get_neighbourhood(rx, projects, 5, downstream=False))
+
+        # dependants of dependencies aren't included.
+        self.assertEqual([a, b, c, e], tsviz.focus_modules(rx, projects, 1))
+        self.assertEqual([], c.dependant_modules)
+        self.assertEqual([b], e.dependant_modules)
+
+        txt = tsviz.render_dot_file(tsviz.focus_modules(rx, projects, 1))
+        self.assertEqual(-1, txt.find("D_ts"))
+        self.assertEqual(-1, txt.find("F_ts"))
+
+    def test_collapse_modules(self):
+        a = tsviz.Module("src/a/A.ts", "")
+        b = tsviz.Module("src/a/B.ts", "")
+        c = tsviz.Module("src/c/C.ts", "")
+        d = tsviz.Module("src/c/d/D.ts", "")
+        react = tsviz.Module("react", "")
+        react.is_missing_module = True
+
+        a.dependant_modules = [b, c, react]
+        b.dependant_modules = [d]
+        c.dependant_modules = [a]
+        d.dependant_modules = [b]
+        a.has_missing_modules = True
+        for module in [a, b, c, d]:
+            module.declared_dependant_modules = module.dependant_modules
+        a.has_circular_dependencies = c.has_circular_dependencies = True
+        d.highlight = True
+        projects = [a, b, c, d, react]
+
+        groups = tsviz.collapse_modules(projects)
+        self.assertEqual(["react", "src/a", "src/c", "src/c/d"], [group.name for group in groups])
+        react_group, src_a, src_c, src_c_d = groups
+        self.assertEqual({src_c: 1, src_c_d: 1, react_group: 1}, src_a.dependencies)
+        self.assertEqual(True, react_group.is_missing_module)
+        self.assertEqual(False, src_a.is_missing_module)
+        self.assertEqual(True, src_a.has_missing_modules)
+        self.assertEqual(True, src_c.has_circular_dependencies)
+        self.assertEqual(True, src_c_d.highlight)
+
+        groups = tsviz.collapse_modules(projects, 2)
+        self.assertEqual(["react", "src/a", "src/c"], [group.name for group in groups])
+        self.assertEqual({groups[1]: 2}, groups[2].dependencies)
+
+        f = io.StringIO()
+        tsviz.write_collapsed_dot_file(f, groups, clusters=True)
+        txt = f.getvalue()
+        self.assertNotEqual(-1, txt.find("subgraph cluster_src {"))
+        self.assertNotEqual(-1, txt.find("dir_src_c [ label=\"src/c (2)\""))
+        self.assertNotEqual(-1, txt.find("dir_src_c -> dir_src_a [label=\"2\""))
+
+        self.assertEqual("/opt/lib", tsviz.get_group_name("/opt/lib/Missing.ts"))
+        self.assertEqual("/opt", tsviz.get_group_name("/opt/lib/Missing.ts", 1))
+        self.assertEqual("/Missing.ts", tsviz.get_group_name("/Missing.ts", 1))
+
+    def test_graph_metrics(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+        e = tsviz.Module("./E.ts")
+
+        a.add_dependency(b.filename)
+        a.add_dependency(e.filename)
+        b.add_dependency(c.filename)
+        c.add_dependency(b.filename)
+        c.add_dependency(d.filename)
+        e.add_dependency(d.filename)
+
+        graph = tsviz.process_modules([a, b, c, d, e])
+        metrics = tsviz.get_graph_metrics(graph)
+        self.assertEqual(["./A.ts", "./B.ts", "./C.ts", "./D.ts", "./E.ts"], metrics["modules"])
+        self.assertEqual([0, 2, 1, 2, 1], metrics["fan_in"])
+        self.assertEqual([2, 1, 2, 0, 1], metrics["fan_out"])
+        self.assertEqual([4, 2, 2, 0, 1], metrics["dependencies"])
+        self.assertEqual([0, 2, 2, 4, 1], metrics["dependants"])
+        self.assertEqual([2, 1, 1, 0, 1], metrics["layer"])
+        self.assertEqual([1, 2, 2, 1, 1], metrics["component_size"])
+        self.assertEqual([2], metrics["circular_groups"])
+
+        report = tsviz.get_metrics_report(metrics, top=1)
+        self.assertNotEqual(-1, report.find("most depended upon:\n         4  ./D.ts"))
+
+    def test_explain_dependency(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+
+        a.add_dependency(b.filename)
+        b.add_dependency(c.filename)
+
+        modules = [a, b, c]
+        reachability = tsviz.process_modules(modules).get_reachability()
+
+        txt = tsviz.explain_dependency(reachability, modules, "./a.ts", "./c")
+        self.assertEqual("./A.ts depends on ./C.ts:\n    ./A.ts\n -> ./B.ts\n -> ./C.ts", txt)
+
+        txt = tsviz.explain_dependency(reachability, modules, "./c.ts", "./a.ts")
+        self.assertEqual("./C.ts does not depend on ./A.ts.", txt)
+
     def test_declared_dependencies_generates_highlight_even_though_dependency_is_eliminated_as_transitive(self):
         a = tsviz.Module("./A.ts")
         b = tsviz.Module("./B.ts")
@@ -132,6 +449,37 @@ class Tests(unittest.TestCase):
 
         # TODO: test with eliminated transisitive deps.
 
+    def test_modules_are_compact(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        a.add_dependency(os.path.abspath("B"))
+        tsviz.process_modules([a, b])
+
+        self.assertEqual(False, hasattr(a, "__dict__"))
+        self.assertIs(b.filename, a.dependant_module_names[0])
+
+        graph = tsviz.DependencyGraph([a, b])
+        self.assertEqual([1], list(graph.edges[0]))
+
+    def test_module_registry_indexes_missing_modules(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+
+        missing = os.path.abspath("./C")
+        a.add_dependency(missing)
+        b.add_dependency(missing)
+
+        modules = [a, b]
+        registry = tsviz.ModuleRegistry(modules)
+        a.resolve_modules_from_names(registry)
+        b.resolve_modules_from_names(registry)
+
+        # missing module is only created once, and is visible in the list.
+        self.assertEqual(3, len(modules))
+        self.assertIs(a.dependant_modules[0], b.dependant_modules[0])
+        self.assertIs(modules[2], registry.get_by_filename(modules[2].filename))
+        self.assertIs(a, registry.get_by_loose_name("/some/other/dir/a.TS"))
+
     def test_circular_dependencies_are_flagged(self):
         a = tsviz.Module("./A.ts")
         b = tsviz.Module("./B.ts")
@@ -179,6 +527,32 @@ class Tests(unittest.TestCase):
         self.assertEqual([b], c.circular_dependencies)
         self.assertEqual([c], d.circular_dependencies)
 
+    def test_strongly_connected_components_in_reverse_topological_order(self):
+        a = tsviz.Module("./A.ts")
+        b = tsviz.Module("./B.ts")
+        c = tsviz.Module("./C.ts")
+        d = tsviz.Module("./D.ts")
+
+        a.dependant_modules = [b]
+        b.dependant_modules = [c]
+        c.dependant_modules = [b, d]
+        d.dependant_modules = [d]
+
+        graph = tsviz.DependencyGraph([a, b, c, d])
+        components = graph.get_components()
+
+        self.assertEqual([[3], [1, 2], [0]], components)
+        self.assertEqual([[3], [1, 2]], graph.get_circular_components())
+
+    def test_self_dependency_is_flagged_as_circular(self):
+        a = tsviz.Module("./A.ts")
+        a.add_dependency(a.filename)
+
+        tsviz.process_modules([a])
+
+        self.assertEqual(True, a.has_circular_dependencies)
+        self.assertEqual([a], a.circular_dependencies)
+
     def test_highlighting_top_level_node_flags_dependants(self):
         a = tsviz.Module("./A.ts")
         b = tsviz.Module("./B.ts")
@@ -201,6 +575,501 @@ class Tests(unittest.TestCase):
         self.assertEqual(True, c.highlighted_dependents)
         self.assertEqual(True, d.highlighted_dependents)
 
+    def test_parallel_parsing_matches_serial_parsing(self):
+        root = self.get_temp_dir()
+        files = {}
+        for i in range(20):
+            files["src/M{0}.ts".format(i)] = "import {{ x }} from \"./M{0}\";\nconst y = require('./M{1}');\n".format(i + 1, i + 2)
+        write_files(root, files)
+
+        filenames = sorted(os.path.join(root, name) for name in files)
+        serial = tsviz.read_all_module_specifiers(filenames, jobs=1)
+        parallel = tsviz.read_all_module_specifiers(filenames, jobs=3)
+
+        self.assertEqual(serial, parallel)
+        self.assertEqual(["./M1", "./M2"], sorted(set(serial[0])))
+
+    def test_streaming_pipeline_matches_analyze(self):
+        root = self.get_temp_dir()
+        files = {}
+        for i in range(30):
+            files["src/d{0}/M{1}.ts".format(i % 3, i)] = "import {{ x }} from \"../d{0}/M{1}\";\nconst y = require('./Missing{1}');\n".format((i + 1) % 3, i + 1)
+        write_files(root, files)
+        src = os.path.join(root, "src")
+
+        expected = tsviz.Analyzer(src)
+        expected.analyze()
+
+        cache = tsviz.ParseCache(os.path.join(root, ".tsviz-cache"))
+        for jobs in [1, 2, 2]:
+            analyzer = tsviz.Analyzer(src, jobs=jobs, cache=cache)
+            analyzer.analyze_streaming()
+            self.assertEqual(expected.render_dot_file(), analyzer.render_dot_file())
+
+        filenames = [os.path.join(src, name[4:]) for name in sorted(files)]
+        streamed = list(tsviz.stream_module_specifiers(iter(filenames), jobs=2, window=2))
+        self.assertEqual(filenames, [filename for filename, _ in streamed])
+        self.assertEqual(tsviz.read_all_module_specifiers(filenames), [list(specifiers) for _, specifiers in streamed])
+
+        self.assertRaises(MemoryError, tsviz.Analyzer(src).analyze_streaming, max_memory=1)
+
+        # the limit also holds while the descendant bitsets are built.
+        graph = tsviz.DependencyGraph(expected.sources)
+        graph.max_memory = 1
+        self.assertRaises(MemoryError, graph.get_component_descendants)
+
+    def test_get_tsfiles_in_dir_prunes_ignored_directories(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            ".gitignore": "# build output\ngenerated/\n*.spec.ts\n!keep.spec.ts\n/src/local.ts\n",
+            "src/A.ts": "",
+            "src/A.spec.ts": "",
+            "src/keep.spec.ts": "",
+            "src/local.ts": "",
+            "src/B.js": "",
+            "src/legacy/C.ts": "",
+            "src/generated/D.ts": "",
+            "node_modules/lib/index.ts": "",
+            "dist/A.ts": "",
+        })
+        excluder = re.compile(str.lower(os.path.join(root, "src", "legacy")))
+
+        files = tsviz.get_tsfiles_in_dir(root, excluder)
+        self.assertEqual(
+            ["src/A.ts", "src/keep.spec.ts"],
+            sorted(os.path.relpath(file, root).replace(os.sep, "/") for file in files)
+        )
+
+        files = tsviz.get_tsfiles_in_dir(root, use_ignores=False)
+        self.assertEqual(8, len(files))
+
+    def test_get_tsfiles_in_dir_falls_back_to_javascript(self):
+        root = self.get_temp_dir()
+        try:
+            write_files(root, {"A.js": "", "lib/B.js": "", "README.md": ""})
+            files = tsviz.get_tsfiles_in_dir(root)
+            self.assertEqual(2, len(files))
+            self.assertEqual(".js", tsviz.extension)
+        finally:
+            tsviz.extension = ".ts"
+
+    def test_synthetic_benchmark_times_every_phase(self):
+        import benchmarks
+
+        root = self.get_temp_dir()
+        try:
+            imports = benchmarks.generate_synthetic_repository(root, files=30, fan_out=3, cycle_density=0.2, missing_ratio=0.1)
+            self.assertEqual(90, imports)
+
+            timings = benchmarks.bench_pipeline(root)
+            self.assertEqual(
+                ["get_tsfiles_in_dir", "highlight_modules", "process_modules", "read_module_specifiers",
+                 "remove_transitive_dependencies", "render_dot_file", "total"],
+                sorted(timings)
+            )
+        finally:
+            tsviz.extension = ".ts"
+
+    def test_process_reports_phase_timings(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "A.ts": "import { b } from \"./B\";\n",
+            "B.ts": "export class B {}\n",
+        })
+
+        timings = tsviz.PhaseTimings()
+        seen = []
+        timings.add_hook(lambda name, metrics: seen.append((name, metrics["items"])))
+        tsviz.process(root, os.path.join(root, "graph.dot"), None, ".*/b", False, False, False, timings=timings)
+
+        self.assertEqual([
+            ("walk", 2), ("read", 2), ("parse", 1), ("resolve", 2), ("cycles", 0), ("sort", 2),
+            ("reachability", 2), ("reduction", 1), ("highlight", 1), ("render", 2),
+        ], seen)
+        for metrics in timings.phases:
+            self.assertEqual(True, metrics["wall"] >= 0)
+        self.assertEqual(["phases", "total"], sorted(timings.to_json()))
+        self.assertEqual(12, len(timings.get_report().split("\n")))
+
+        # without highlights or --why, the reachability index is never built.
+        timings = tsviz.PhaseTimings()
+        analyzer = tsviz.process(root, None, None, None, False, False, True, timings=timings)
+        self.assertEqual(None, analyzer.graph.reachability)
+        self.assertEqual(None, analyzer.graph.component_descendants)
+        self.assertEqual(False, "reachability" in [metrics["name"] for metrics in timings.phases])
+
+    def test_module_resolver(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "tsconfig.json": """{
+                // comments and trailing commas are allowed.
+                "compilerOptions": {
+                    "baseUrl": "./src",
+                    "paths": {
+                        "@app/*": ["app/*"],
+                        "@shared": ["shared/index.ts"],
+                    },
+                },
+            }""",
+            "src/app/main.ts": "",
+            "src/app/widgets/index.ts": "",
+            "src/shared/index.ts": "",
+            "src/util.ts": "",
+        })
+        src = os.path.join(root, "src")
+        app = os.path.join(src, "app")
+        filenames = [
+            os.path.join(app, "main.ts"),
+            os.path.join(app, "widgets", "index.ts"),
+            os.path.join(src, "shared", "index.ts"),
+            os.path.join(src, "util.ts"),
+        ]
+
+        resolver = tsviz.ModuleResolver(filenames, tsviz.find_tsconfig(root))
+        self.assertEqual(filenames[0], resolver.resolve(app, "./main"))
+        self.assertEqual(filenames[2], resolver.resolve(app, "@shared"))
+        self.assertEqual(filenames[3], resolver.resolve(app, "util"))
+        # walked files are never checked on disk.
+        self.assertEqual(0, resolver.stat_cache.checks)
+
+        self.assertEqual(filenames[0], resolver.resolve(app, "./main.js"))
+        self.assertEqual(filenames[1], resolver.resolve(app, "./widgets"))
+        self.assertEqual(filenames[1], resolver.resolve(src, "@app/widgets"))
+
+        # unresolved modules keep their old names.
+        self.assertEqual("lodash", resolver.resolve(app, "lodash"))
+        self.assertEqual(os.path.join(app, "missing.ts"), resolver.resolve(app, "./missing"))
+
+        # every path is only checked once.
+        checks = resolver.stat_cache.checks
+        other = tsviz.ModuleResolver(stat_cache=resolver.stat_cache)
+        self.assertEqual(os.path.join(app, "missing.ts"), other.resolve(app, "./missing"))
+        self.assertEqual(filenames[0], other.resolve(app, "./main.js"))
+        self.assertEqual(checks, resolver.stat_cache.checks)
+
+    def test_workspace_packages_are_merged(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "package.json": json.dumps({"workspaces": ["packages/*", "!packages/ignored"]}),
+            "packages/app/package.json": json.dumps({"name": "@acme/app"}),
+            "packages/app/src/main.ts": "import { lib } from \"@acme/lib\";\nimport { util } from \"@acme/lib/util\";\nimport * as react from \"react\";\n",
+            "packages/lib/package.json": json.dumps({"name": "@acme/lib", "main": "dist/index.js"}),
+            "packages/lib/src/index.ts": "export * from \"./util\";\n",
+            "packages/lib/src/util.ts": "",
+            "packages/ignored/package.json": json.dumps({"name": "ignored"}),
+            "packages/ignored/index.ts": "",
+        })
+        packages = tsviz.find_workspace_packages(root)
+        self.assertEqual(["@acme/app", "@acme/lib"], [name for name, _ in packages])
+
+        cache = tsviz.ParseCache(os.path.join(root, ".tsviz-cache"))
+        analyzer = tsviz.Analyzer(root, jobs=2, cache=cache, keep_deps=True)
+        analyzer.analyze_workspace()
+        name = os.path.basename(root)
+        main = tsviz.find_module(name + "/packages/app/src/main.ts", analyzer.modules)
+        self.assertEqual(
+            ["react", name + "/packages/lib/src/index.ts", name + "/packages/lib/src/util.ts"],
+            [dep.name for dep in main.declared_dependant_modules]
+        )
+
+        # only changed packages are read again.
+        cache_dir = os.path.join(root, ".tsviz-cache", "packages")
+        write_files(root, {"packages/lib/src/util.ts": "import \"./index\";\n"})
+        results = tsviz.read_workspace_packages(packages, cache_dir=cache_dir)
+        self.assertEqual([True, False], [cached for _, _, cached in results])
+        self.assertEqual([["./index"]], results[1][1][1:])
+
+        # but imports of other packages see their new files and entries.
+        write_files(root, {
+            "packages/lib/package.json": json.dumps({"name": "@acme/lib", "source": "src/main.ts"}),
+            "packages/lib/src/main.ts": "",
+        })
+        analyzer = tsviz.Analyzer(root, cache=cache, keep_deps=True)
+        analyzer.analyze_workspace()
+        main = tsviz.find_module(name + "/packages/app/src/main.ts", analyzer.modules)
+        self.assertEqual(
+            ["react", name + "/packages/lib/src/main.ts", name + "/packages/lib/src/util.ts"],
+            [dep.name for dep in main.declared_dependant_modules]
+        )
+
+    def test_workspace_packages_resolve_from_relative_root(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "package.json": json.dumps({"workspaces": ["packages/*"]}),
+            "packages/app/package.json": json.dumps({"name": "@acme/app"}),
+            "packages/app/src/main.ts": "import { util } from \"@acme/lib/util\";\n",
+            "packages/lib/package.json": json.dumps({"name": "@acme/lib"}),
+            "packages/lib/src/util.ts": "",
+        })
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(root)
+
+        analyzer = tsviz.Analyzer(".", keep_deps=True)
+        analyzer.analyze_workspace()
+        main = tsviz.find_module("packages/app/src/main.ts", analyzer.modules)
+        self.assertEqual(["packages/lib/src/util.ts"], [dep.name for dep in main.declared_dependant_modules])
+        self.assertEqual([False], [dep.is_missing_module for dep in main.declared_dependant_modules])
+
+    def test_analyzers_run_side_by_side(self):
+        import threading
+
+        ts_root = self.get_temp_dir()
+        js_root = self.get_temp_dir()
+        write_files(ts_root, {
+            "A.ts": "import { b } from \"./lib/B\";\n",
+            "lib/B.ts": "export class B {}\n",
+        })
+        write_files(js_root, {
+            "a.js": "const b = require('./b');\nconst c = require('./c');\n",
+            "b.js": "const c = require('./c');\n",
+            "c.js": "",
+        })
+
+        settings = (tsviz.extension, tsviz.solution_path)
+        analyzers = [
+            tsviz.Analyzer(ts_root, keep_deps=True, highlight=".*/lib/.*"),
+            tsviz.Analyzer(js_root),
+        ]
+        threads = [threading.Thread(target=analyzer.analyze) for analyzer in analyzers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ts, js = analyzers
+        self.assertEqual(".ts", ts.extension)
+        self.assertEqual(".js", js.extension)
+        self.assertEqual(["A.ts", "lib/B.ts"], [module.name[len(os.path.basename(ts_root)) + 1:] for module in ts.modules])
+        self.assertEqual([True, False], [module.has_highlighted_dependencies(ts.reachability) for module in ts.modules])
+        self.assertEqual([1, 1, 0], [len(module.dependant_modules) for module in js.modules])
+        self.assertEqual(True, "a_js -> " in js.render_dot_file())
+
+        # module-level settings are left alone.
+        self.assertEqual(settings, (tsviz.extension, tsviz.solution_path))
+
+    def test_graph_server_answers_queries(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "A.ts": "import { b } from \"./B\";\n",
+            "B.ts": "import { c } from \"./C\";\n",
+            "C.ts": "export class C {}\n",
+        })
+        name = os.path.basename(root)
+        server = tsviz.GraphServer(tsviz.Watcher(root, None))
+
+        def query(path, **params):
+            status, content_type, body = server.handle(path, params)
+            self.assertEqual("application/json", content_type)
+            return status, json.loads(body)
+
+        self.assertEqual((200, [name + "/B.ts"]), query("/dependencies", module=".*/a.ts"))
+        self.assertEqual((200, [name + "/B.ts", name + "/C.ts"]), query("/dependencies", module=".*/a.ts", all="1"))
+        self.assertEqual((200, [name + "/A.ts", name + "/B.ts"]), query("/dependants", module=".*/c.ts", all="1"))
+        self.assertEqual((200, [name + "/A.ts", name + "/B.ts", name + "/C.ts"]), query("/why", module=".*/a.ts", dependency=".*/c.ts"))
+        self.assertEqual((200, []), query("/cycles"))
+        self.assertEqual(404, query("/dependencies", module="nothing")[0])
+        self.assertEqual(400, query("/dependencies")[0])
+        self.assertEqual(400, query("/dependencies", module="(")[0])
+        self.assertEqual(400, query("/dot", exclude="[")[0])
+
+        status, content_type, body = server.handle("/dot", {"exclude": ".*/b.ts"})
+        self.assertEqual(True, "_A_ts -> " in body)
+        self.assertEqual(False, "_B_ts -> " in body)
+
+        # only rebuilt when files changed.
+        self.assertEqual((200, {"changed": False}), query("/refresh"))
+        write_files(root, {"C.ts": "import { a } from \"./A\";\n"})
+        os.utime(os.path.join(root, "C.ts"), ns=(0, 0))
+        self.assertEqual((200, {"changed": True}), query("/refresh"))
+        self.assertEqual((200, [[name + "/A.ts", name + "/B.ts", name + "/C.ts"]]), query("/cycles"))
+
+    def test_snapshot_renders_without_source_tree(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "src/A.ts": "import { b } from \"./B\";\nimport { c } from \"./C\";\nimport { x } from \"./Missing\";\n",
+            "src/B.ts": "import { c } from \"./C\";\n",
+            "src/C.ts": "import { a } from \"./A\";\n",
+            "src/shared/D.ts": "import { c } from \"../C\";\n",
+        })
+        src = os.path.join(root, "src")
+        snapshot = os.path.join(root, "graph.snapshot.gz")
+        settings = [
+            {},
+            {"keep_deps": True},
+            {"exclude": ".*shared.*", "highlight": ".*/b.ts", "highlight_all": True},
+        ]
+
+        expected = []
+        for options in settings:
+            analyzer = tsviz.Analyzer(src, **options)
+            analyzer.analyze()
+            expected.append(analyzer.render_dot_file())
+
+        analyzer = tsviz.Analyzer(src)
+        analyzer.analyze()
+        analyzer.save_snapshot(snapshot)
+
+        data = tsviz.read_snapshot(snapshot)
+        self.assertEqual(["src/A.ts", "src/B.ts", "src/C.ts", "src/shared/D.ts"], data["names"])
+        self.assertEqual([os.path.join(src, "Missing.ts")], [data["filenames"][index] for index in data["missing"][0]])
+
+        # rendered without reading any sources.
+        shutil.rmtree(src)
+        for options, txt in zip(settings, expected):
+            self.assertEqual(txt, tsviz.load_snapshot(snapshot, **options).render_dot_file())
+
+        invalid = os.path.join(root, "invalid.json")
+        write_files(root, {"invalid.json": "{}"})
+        self.assertRaises(ValueError, tsviz.read_snapshot, invalid)
+
+    def test_changed_files_report_regressions(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "src/A.ts": "import { b } from \"./B\";\nimport { x } from \"./Missing\";\n",
+            "src/B.ts": "import { a } from \"./A\";\n",
+            "src/C.ts": "import { d } from \"./D\";\n",
+            "src/D.ts": "",
+            "src/E.ts": "",
+        })
+        src = os.path.join(root, "src")
+        snapshot = os.path.join(root, "base.snapshot")
+        analyzer = tsviz.Analyzer(src)
+        analyzer.analyze()
+        analyzer.save_snapshot(snapshot)
+
+        # unchanged files give no regressions.
+        analyzer, new_cycles, new_missing = tsviz.check_changes(snapshot, [])
+        self.assertEqual(([], []), (new_cycles, new_missing))
+
+        write_files(root, {
+            "src/D.ts": "import { c } from \"./C\";\nimport { y } from \"./Gone\";\nimport * as React from \"react\";\n",
+            "src/F.ts": "import { e } from \"./E\";\nimport { fp } from \"lodash/fp\";\n",
+        })
+        os.remove(os.path.join(src, "E.ts"))
+        changed = [os.path.join(src, name) for name in ["D.ts", "E.ts", "F.ts", "README.md"]]
+        analyzer, new_cycles, new_missing = tsviz.check_changes(snapshot, changed)
+
+        self.assertEqual([["src/C.ts", "src/D.ts"]], new_cycles)
+        self.assertEqual([("src/D.ts", "src/Gone.ts"), ("src/F.ts", "src/E.ts")], new_missing)
+        self.assertEqual(True, "New circular dependency: src/C.ts, src/D.ts\n" in tsviz.get_regression_report(new_cycles, new_missing))
+
+        # the patched graph is the graph of the changed tree.
+        expected = tsviz.Analyzer(src, keep_deps=True)
+        expected.analyze()
+        self.assertEqual(expected.render_dot_file(), analyzer.render_dot_file())
+
+    def test_check_only_reports_cycles_and_missing_modules(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "src/A.ts": "import { b } from \"./B\";\nimport { x } from \"./Missing\";\nimport * as react from \"react\";\n",
+            "src/B.ts": "import { a } from \"./A\";\nimport { y } from \"./Gone\";\nimport { fp } from \"lodash/fp\";\n",
+            "src/C.ts": "import { a } from \"./A\";\n",
+        })
+        src = os.path.join(root, "src")
+
+        cycles, missing = tsviz.Analyzer(src).check()
+        self.assertEqual([["src/A.ts", "src/B.ts"]], cycles)
+        self.assertEqual([("src/A.ts", "src/Missing.ts"), ("src/B.ts", "src/Gone.ts")], missing)
+        self.assertEqual(tsviz.check_exit_cycles | tsviz.check_exit_missing, tsviz.get_check_exit_code(cycles, missing))
+
+        self.assertEqual(([["src/A.ts", "src/B.ts"]], []), tsviz.Analyzer(src).check(missing=False))
+        self.assertEqual(([], [("src/A.ts", "src/Missing.ts")]), tsviz.Analyzer(src).check(fail_fast=True))
+        self.assertEqual(0, tsviz.get_check_exit_code([], []))
+        self.assertEqual(True, "cycle: src/A.ts, src/B.ts\n" in tsviz.get_check_report(cycles, missing))
+
+        # imports through tsconfig paths are part of the source tree.
+        write_files(root, {
+            "src/tsconfig.json": json.dumps({"compilerOptions": {"baseUrl": ".", "paths": {"@app/*": ["./*"]}}}),
+            "src/C.ts": "import { a } from \"@app/A\";\nimport { d } from \"@app/D\";\n",
+        })
+        _, missing = tsviz.Analyzer(src).check(cycles=False)
+        self.assertEqual([("src/C.ts", "src/@app/D.ts")], [item for item in missing if item[0] == "src/C.ts"])
+
+        # and so are imports resolved through baseUrl alone.
+        write_files(root, {
+            "src/tsconfig.json": json.dumps({"compilerOptions": {"baseUrl": "."}}),
+            "src/a/A.ts": "import { b } from \"b/B\";\n",
+            "src/b/B.ts": "import { a } from \"a/A\";\n",
+        })
+        cycles, _ = tsviz.Analyzer(src).check(missing=False)
+        self.assertEqual(True, ["src/a/A.ts", "src/b/B.ts"] in cycles)
+
+    def test_parse_cache_skips_unchanged_files(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "A.ts": "import { b } from \"./B\";\n",
+            "B.ts": "export class B {}\n",
+        })
+        filenames = [os.path.join(root, "A.ts"), os.path.join(root, "B.ts")]
+        cache_dir = os.path.join(root, tsviz.cache_directory_name)
+
+        cache = tsviz.ParseCache(cache_dir)
+        specifiers = tsviz.read_all_module_specifiers(filenames, cache=cache)
+        cache.save()
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+        # warm cache.
+        cache = tsviz.ParseCache(cache_dir)
+        self.assertEqual(specifiers, tsviz.read_all_module_specifiers(filenames, cache=cache))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+        # modified file.
+        write_files(root, {"B.ts": "const a = require('./A');\n"})
+        cache = tsviz.ParseCache(cache_dir)
+        specifiers = tsviz.read_all_module_specifiers(filenames, cache=cache)
+        self.assertEqual(["./A"], specifiers[1])
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        cache.save()
+
+        # parser changes invalidate everything.
+        cache = tsviz.ParseCache(cache_dir)
+        cache.stamp = "other"
+        cache.entries = {}
+        cache.load()
+        self.assertEqual({}, cache.entries)
+
+    def test_watcher_only_rewrites_changed_graphs(self):
+        root = self.get_temp_dir()
+        write_files(root, {
+            "src/A.ts": "const b = require('./B');\n",
+            "src/B.ts": "export class B {}\n",
+        })
+        dot_file = os.path.join(root, "graph.dot")
+        watcher = tsviz.Watcher(os.path.join(root, "src/"), dot_file)
+
+        self.assertEqual(True, watcher.scan())
+        self.assertEqual(True, watcher.update())
+        self.assertEqual(False, watcher.scan())
+
+        # changed file, but same imports: the graph isn't even rebuilt.
+        write_files(root, {"src/B.ts": "export class B2 {}\n"})
+        os.utime(os.path.join(root, "src/B.ts"), ns=(0, 0))
+        self.assertEqual(True, watcher.scan())
+        watcher.analyzer.timings = tsviz.PhaseTimings()
+        self.assertEqual(False, watcher.update())
+        self.assertEqual([], watcher.analyzer.timings.phases)
+
+        # changed imports rebuild the graph.
+        write_files(root, {"src/B.ts": "import \"./Missing\";\n"})
+        self.assertEqual(True, watcher.scan())
+        self.assertEqual(True, watcher.update())
+        write_files(root, {"src/B.ts": "export class B3 {}\n"})
+        self.assertEqual(True, watcher.scan())
+        self.assertEqual(True, watcher.update())
+        write_files(root, {"src/B.ts": "export class B4 {}\n"})
+        self.assertEqual(True, watcher.scan())
+        self.assertEqual(False, watcher.update())
+
+        # new dependency.
+        write_files(root, {"src/C.ts": "const a = require('./A');\n"})
+        self.assertEqual(True, watcher.scan())
+        self.assertEqual(True, watcher.update())
+        with open(dot_file) as f:
+            self.assertEqual(True, "C_ts -> A_ts" in f.read())
+
 
 if __name__ == "__main__":
     unittest.main()
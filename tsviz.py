@@ -8,22 +8,37 @@
 #
 
 from argparse import ArgumentParser
+import contextlib
+import hashlib
+import json
+import logging
 import re
 import os
+import sys
+from array import array
+from collections import deque
 
-debug_output = False
+# defaults for the module-level functions. Analyzer doesn't use these.
 solution_path = "."
 allow_loose_module_match = False
 
+# line-based patterns. superseded by scan_module_specifiers().
 module_import_declaration = re.compile("import .* from [\"'](.*)[\"'];.*")
 module_require_declaration = re.compile(".*require\([\"'](.*)[\"']\).*")
 
 extension = ".ts"
 
+# bump whenever changes to the parser changes its results.
+PARSER_VERSION = 3
+
+cache_directory_name = ".tsviz-cache"
+
+# verbose output. enabled by --verbose, or by configuring logging.
+logger = logging.getLogger("tsviz")
+
+
 def debug(txt):
-    global debug_output
-    if debug_output:
-        print(txt)
+    logger.debug(txt)
 
 
 def get_unix_path(file):
@@ -42,9 +57,26 @@ def set_working_basedir(root_dir):
 
 
 class Module(object):
-    def __init__(self, filename):
-        self.name = self.get_name_from_filename(filename)
-        self.filename = os.path.abspath(filename)
+    # large graphs have 100k+ modules: no per-instance __dict__, and
+    # filenames are interned, since every import resolving to a module
+    # repeats its filename.
+    __slots__ = (
+        "name",
+        "filename",
+        "dependant_module_names",
+        "declared_dependant_modules",
+        "dependant_modules",
+        "has_missing_modules",
+        "is_missing_module",
+        "highlight",
+        "highlighted_dependents",
+        "has_circular_dependencies",
+        "circular_dependencies",
+    )
+
+    def __init__(self, filename, base_path=None):
+        self.name = self.get_name_from_filename(filename, base_path)
+        self.filename = sys.intern(os.path.abspath(filename))
         self.dependant_module_names = []
 
         # dependant modules, as declared in file.
@@ -55,7 +87,6 @@ class Module(object):
         # subject to transitive dependency-elimination.
         self.dependant_modules = []
 
-        self.missing_module_names = []
         self.has_missing_modules = False
         self.is_missing_module = False
         self.highlight = False
@@ -63,15 +94,23 @@ class Module(object):
         self.has_circular_dependencies = False
         self.circular_dependencies = []
 
-    def get_name_from_filename(self, filename):
+    @property
+    def missing_module_names(self):
+        # derived, rather than kept in one more list per module.
+        return [dep.name for dep in self.declared_dependant_modules if dep.is_missing_module]
+
+    def get_name_from_filename(self, filename, base_path=None):
+        if base_path is None:
+            base_path = solution_path
+
         if filename.find("/") == -1:
             return filename
-        elif len(solution_path) == 0:
+        elif len(base_path) == 0:
             return filename
-        elif solution_path == ".":
+        elif base_path == ".":
             return filename
         else:
-            return filename[len(solution_path)+1::]
+            return filename[len(base_path)+1::]
 
     def get_friendly_id(self):
         return self.name.replace(".", "_").replace("-", "_").replace("/", "_")
@@ -83,71 +122,57 @@ class Module(object):
             debug("Info: resolved npm-module or JSON data-file {0}.".format(module_name))
         elif not module_name.endswith(extension):
             module_name += extension
-        filename = module_name
+        filename = sys.intern(module_name)
         if filename not in self.dependant_module_names:
             # print("{0}: Adding to dependency: {1}".format(self.name, filename))
             self.dependant_module_names.append(filename)
 
-    def get_module_references(self, lines):
-        imports = []
-        for line in lines:
-            if line.startswith("import "):
-                imports.append(line)
-            if line.find("require("):
-                imports.append(line)
-        return imports
-
-    def get_module_imports(self, imports):
-        result = []
-        for item in imports:
-            match = module_import_declaration.match(item)
-            if match:
-                module = match.groups()[0]
-                full_module_path = self.get_module_path(module)
-                result.append(full_module_path)
-            match = module_require_declaration.match(item)
-            if match:
-                module = match.groups()[0]
-                full_module_path = self.get_module_path(module)
-                result.append(full_module_path)
-        return result
-
     def get_module_path(self, module):
         if module.find("/") != -1:
             return os.path.abspath(os.path.join(os.path.dirname(self.filename), module))
         else:
             return module
 
-    def get_declared_module_dependencies(self):
-        lines = get_lines_from_file(self.filename)
-        import_lines = self.get_module_references(lines)
-        imports = self.get_module_imports(import_lines)
-        return imports
+    def get_declared_module_dependencies(self, strict=False):
+        specifiers = read_module_specifiers(self.filename, strict)
+        return [self.get_module_path(module) for module in specifiers]
+
+    def apply_module_specifiers(self, specifiers, resolver=None):
+        if resolver is None:
+            for module in specifiers:
+                self.add_dependency(self.get_module_path(module))
+            return
 
-    def apply_declared_module_dependencies(self):
-        imports = self.get_declared_module_dependencies()
-        for item in imports:
-            self.add_dependency(item)
+        directory = os.path.dirname(self.filename)
+        for module in specifiers:
+            filename = resolver.resolve(directory, module)
+            if filename not in self.dependant_module_names:
+                self.dependant_module_names.append(filename)
+
+    def apply_declared_module_dependencies(self, strict=False, resolver=None):
+        self.apply_module_specifiers(read_module_specifiers(self.filename, strict), resolver)
 
     def resolve_modules_from_names(self, modules):
-        global allow_loose_module_match
+        # accept plain lists for convenience, but resolve through an index.
+        if not isinstance(modules, ModuleRegistry):
+            modules = ModuleRegistry(modules)
+
         for name in self.dependant_module_names:
-            module = get_module_by_filename(name, modules)
-            if module is None and allow_loose_module_match:
-                module = get_module_by_loose_name(name, modules)
+            module = modules.get_by_filename(name)
+            if module is None and modules.loose:
+                module = modules.get_by_loose_name(name)
 
                 # check if we still haven't matched up!
             if module is None:
                 print("ERROR! Failed to resolve dependency {0} in module {1}!".format(name, self.name))
                 # track missing deps consistently
-                missing_module_id = name.replace("-", "")
-                module = Module(missing_module_id)
+                missing_module_id = get_missing_module_id(name)
+                module = Module(missing_module_id, modules.base_path)
                 module.is_missing_module = True
-                modules.append(module)
+                modules.add(module, name)
 
             if module.is_missing_module:
                 self.has_missing_modules = True
-                self.missing_module_names.append(module.name)
 
             self.dependant_modules.append(module)
 
@@ -195,7 +220,10 @@ class Module(object):
                 dep.add_nested_dependencies_to(all_deps)
 
 
-    def has_highlighted_dependencies(self):
+    def has_highlighted_dependencies(self, reachability=None):
+        if reachability is not None:
+            return reachability.has_highlighted_dependencies(self)
+
         allDeps = self.get_nested_dependencies()
         for dep in allDeps:
             if dep.highlight:
@@ -210,6 +238,8 @@ class Module(object):
         return False
 
     def detect_circular_dependencies(self):
+        # checks this module only. use the module-level
+        # detect_circular_dependencies() to check a whole graph in one pass.
         all_nested_deps = self.get_nested_dependencies()
         for dep in all_nested_deps:
             for subdep in dep.declared_dependant_modules:
@@ -219,7 +249,642 @@ class Module(object):
                     self.circular_dependencies.append(dep)
 
 
+# skips everything which can't introduce a module-specifier: whitespace,
+# punctuation, strings, comments, template-literals without ${...} and
+# identifiers other than the keywords. stops at other template-literals, at
+# a slash (division or regexp), a keyword or an unterminated string.
+# inside ${...} expressions, also stops at braces.
+#
+# identifiers which can't be keywords are matched separately, since that
+# is much faster than checking every identifier. properties are skipped
+# too, so that foo.require() isn't mistaken for require().
+lexer_skip_pattern = r"""(?:
+    [^"'`/{braces}A-Za-z_$.]+
+  | [A-Za-df-hj-qs-z_$][\w$]*
+  | \.\.\.|\.(?:\s*[A-Za-z_$][\w$]*)?
+  | (?!(?:import|export|require)(?![\w$]))[eir][\w$]*
+  | "[^"\\\n]*(?:\\.[^"\\\n]*)*"
+  | '[^'\\\n]*(?:\\.[^'\\\n]*)*'
+  | `[^`\\$]*(?:(?:\\.|\$(?!\{))[^`\\$]*)*`
+  | //[^\n]*
+  | /\*.*?\*/
+)*"""
+lexer_skip = re.compile(lexer_skip_pattern.replace("{braces}", ""), re.S | re.X)
+lexer_skip_in_template = re.compile(lexer_skip_pattern.replace("{braces}", "{}"), re.S | re.X)
+lexer_keyword = re.compile(r"(?:import|export|require)(?![\w$])")
+
+# next significant token, skipping whitespace and comments.
+lexer_token = re.compile(r"""
+    \s*(?:(?://[^\n]*|/\*.*?\*/)\s*)*
+    (?:
+        (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+      | (?P<name>[A-Za-z_$][\w$]*)
+      | (?P<punct>\S)
+    )?
+""", re.S | re.X)
+
+# common forms of what follows an import-, export- or require-keyword,
+# matched in one go. anything else is left to the token-based scanners.
+lexer_string = r"""(?:"([^"\\\n]*)"|'([^'\\\n]*)')"""
+lexer_import_declaration = re.compile(r"""\s*(?:
+    {string}
+  | \(\s*{string}\s*[),]
+  | (?:type\s+)?(?:[\w$]+\s*,?\s*)?(?:\{{[^{{}}"'`/]*\}}\s*|\*\s*as\s+[\w$]+\s*)?from\s*{string}
+)""".format(string=lexer_string), re.X)
+lexer_export_declaration = re.compile(r"""\s*
+    (?:type\s+)?(?:\*(?:\s*as\s+[\w$]+)?|\{{[^{{}}"'`/]*\}})\s*from\s*{string}
+""".format(string=lexer_string), re.X)
+lexer_require_call = re.compile(r"\s*\(\s*{string}".format(string=lexer_string))
+
+lexer_template_body = re.compile(r"(?:[^`\\$]|\\.|\$(?!\{))*", re.S)
+lexer_regexp_body = re.compile(r"(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])*/", re.S)
+
+# keywords after which a slash starts a regexp, not a division.
+lexer_regexp_keywords = frozenset([
+    "return", "typeof", "instanceof", "in", "of", "new", "delete", "void",
+    "throw", "case", "do", "else", "yield", "await",
+])
+
+lexer_keywords = ("import", "export", "require")
+
+
+def next_token(source, pos):
+    """
+    Returns the kind ("string", "name", "punct" or None at the end of the
+    source), the value and the end-position of the next token. String values
+    are returned without quotes.
+    """
+    match = lexer_token.match(source, pos)
+    kind = match.lastgroup
+    if kind is None:
+        return None, None, match.end()
+    value = match.group(kind)
+    if kind == "string":
+        value = value[1:-1]
+    return kind, value, match.end()
+
+
+def skip_braces(source, pos):
+    # skips a {...} group, like import-bindings. pos is after the "{".
+    depth = 1
+    while depth > 0:
+        kind, value, pos = next_token(source, pos)
+        if kind is None:
+            break
+        if value == "{" and kind == "punct":
+            depth += 1
+        elif value == "}" and kind == "punct":
+            depth -= 1
+    return pos
+
+
+def scan_from_clause(source, pos):
+    # "... from 'x'" ending an import- or export-declaration.
+    # returns the specifier (or None), and where to continue.
+    kind, value, end = next_token(source, pos)
+    if kind == "name" and value == "from":
+        kind, value, end = next_token(source, end)
+        if kind == "string":
+            return value, end
+    return None, pos
+
+
+def scan_import(source, pos):
+    """
+    Scans what follows an import-keyword: an import-declaration, a
+    side-effect import or a dynamic import(). Returns the specifier (or
+    None), and where to continue scanning.
+    """
+    match = lexer_import_declaration.match(source, pos)
+    if match is not None:
+        return match.group(match.lastindex), match.end()
+
+    kind, value, end = next_token(source, pos)
+    if kind == "string":
+        # import "x";
+        return value, end
+    if kind == "punct" and value == "(":
+        # import("x")
+        kind, value, end = next_token(source, end)
+        if kind == "string":
+            after = next_token(source, end)[1]
+            if after in (")", ","):
+                return value, end
+        return None, pos
+
+    # import a, { b as c }, * as d from "x";
+    while kind is not None:
+        if kind == "name":
+            if value == "from":
+                specifier_kind, specifier, specifier_end = next_token(source, end)
+                if specifier_kind == "string":
+                    return specifier, specifier_end
+        elif kind == "punct" and value == "{":
+            end = skip_braces(source, end)
+        elif kind != "punct" or value not in "*,":
+            # not a declaration, like TypeScript's import x = require("x").
+            break
+        kind, value, end = next_token(source, end)
+    return None, pos
+
+
+def scan_export(source, pos):
+    """
+    Scans what follows an export-keyword for a re-export:
+    export * from "x", export * as a from "x", or export { a } from "x".
+    """
+    match = lexer_export_declaration.match(source, pos)
+    if match is not None:
+        return match.group(match.lastindex), match.end()
+
+    kind, value, end = next_token(source, pos)
+    if kind == "name" and value == "type":
+        kind, value, end = next_token(source, end)
+
+    if kind == "punct" and value == "*":
+        kind, value, after = next_token(source, end)
+        if kind == "name" and value == "as":
+            end = next_token(source, after)[2]
+        return scan_from_clause(source, end)
+    if kind == "punct" and value == "{":
+        return scan_from_clause(source, skip_braces(source, end))
+    return None, pos
+
+
+def scan_require(source, pos):
+    match = lexer_require_call.match(source, pos)
+    if match is not None:
+        return match.group(match.lastindex), match.end()
+
+    kind, value, end = next_token(source, pos)
+    if kind == "punct" and value == "(":
+        kind, value, end = next_token(source, end)
+        if kind == "string":
+            return value, end
+    return None, pos
+
+
+def starts_regexp(source, pos):
+    # a slash starts a regexp if it can't be a division: ie. after an
+    # operator, an opening bracket or some keywords.
+    pos -= 1
+    while pos >= 0 and source[pos].isspace():
+        pos -= 1
+    if pos < 0:
+        return True
+
+    char = source[pos]
+    # the end of an operand: a bracket, a string or template-literal, or
+    # a postfix ++ or --.
+    if char in ")]\"'`":
+        return False
+    if char in "+-" and pos > 0 and source[pos - 1] == char:
+        return False
+    if char.isalnum() or char in "_$":
+        end = pos + 1
+        while pos >= 0 and (source[pos].isalnum() or source[pos] in "_$"):
+            pos -= 1
+        return source[pos + 1:end] in lexer_regexp_keywords
+    return True
+
+
+def scan_module_specifiers(source, strict=False):
+    """
+    Returns the module-specifiers imported by source, in order of
+    appearance, in a single pass over the source.
+
+    Recognizes import-declarations (also when spanning multiple lines),
+    side-effect imports, re-exports (export ... from), dynamic import() and
+    require(). Comments, strings, template-literals and regexps are skipped.
+
+    With strict, only the import-block at the top of the file is scanned,
+    and scanning stops at the first other statement. require() and
+    dynamic imports are not found in strict-mode.
+    """
+    if strict:
+        return scan_import_block(source)
+
+    # nothing to find. no need to scan.
+    if not any(keyword in source for keyword in lexer_keywords):
+        return []
+
+    result = []
+    pos = 0
+    length = len(source)
+
+    # brace-depth of every open ${...} expression in a template-literal.
+    depth = 0
+    templates = []
+
+    while True:
+        skip = lexer_skip_in_template if templates else lexer_skip
+        pos = skip.match(source, pos).end()
+        if pos >= length:
+            break
+
+        char = source[pos]
+        if char == "`":
+            pos = skip_template(source, pos + 1, depth, templates)
+
+        elif char == "/":
+            pos += 1
+            if starts_regexp(source, pos - 1):
+                regexp = lexer_regexp_body.match(source, pos)
+                if regexp is not None:
+                    pos = regexp.end()
+
+        elif char == "{":
+            depth += 1
+            pos += 1
+
+        elif char == "}":
+            pos += 1
+            if templates[-1] == depth:
+                # end of ${...}: back into the template-literal.
+                templates.pop()
+                pos = skip_template(source, pos, depth, templates)
+            else:
+                depth -= 1
+
+        elif char in "\"'":
+            # unterminated string.
+            pos += 1
+
+        else:
+            keyword = lexer_keyword.match(source, pos).group()
+            pos += len(keyword)
+
+            if keyword == "import":
+                specifier, pos = scan_import(source, pos)
+            elif keyword == "export":
+                specifier, pos = scan_export(source, pos)
+            else:
+                specifier, pos = scan_require(source, pos)
+            if specifier is not None:
+                result.append(specifier)
+
+    return result
+
+
+def skip_template(source, pos, depth, templates):
+    # skips the body of a template-literal, up to its end, or up to where
+    # an embedded ${...} expression starts.
+    pos = lexer_template_body.match(source, pos).end()
+    if source.startswith("${", pos):
+        templates.append(depth)
+        return pos + 2
+    return pos + 1
+
+
+def scan_import_block(source):
+    result = []
+    pos = 0
+    while True:
+        kind, value, end = next_token(source, pos)
+        if kind == "string" or (kind == "punct" and value == ";"):
+            # directives like "use strict", and empty statements.
+            pos = end
+            continue
+        if kind != "name" or value not in ("import", "export"):
+            break
+
+        if value == "import":
+            specifier, pos = scan_import(source, end)
+        else:
+            specifier, pos = scan_export(source, end)
+        if specifier is None:
+            break
+        result.append(specifier)
+    return result
+
+
+def read_module_specifiers(filename, strict=False):
+    return read_module_file(filename, strict)[0]
+
+
+def read_module_file(filename, strict=False):
+    """
+    Reads filename and returns its module-specifiers, and a digest of the
+    file contents for use by the ParseCache.
+
+    Self-contained, so that it can run in a worker-process.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    digest = get_digest(data)
+    return scan_module_specifiers(get_source_from_bytes(data), strict), digest
+
+
+def get_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_all_module_specifiers(filenames, jobs=1, cache=None, strict=False):
+    """
+    Reads the module-specifiers of all files, using a pool of jobs worker
+    processes if jobs > 1. Results are returned in the same order as
+    filenames, regardless of how the work was distributed.
+
+    If a ParseCache is provided, only files not found in it are read.
+    """
+    if cache is None:
+        return [result[0] for result in read_module_files(filenames, jobs, strict)]
+
+    results = [cache.lookup(filename) for filename in filenames]
+    missing = [filename for filename, result in zip(filenames, results) if result is None]
+    parsed = iter(read_module_files(missing, jobs, strict))
+    for i, filename in enumerate(filenames):
+        if results[i] is None:
+            specifiers, digest = next(parsed)
+            cache.store(filename, specifiers, digest)
+            results[i] = specifiers
+    return results
+
+
+def read_module_files(filenames, jobs=1, strict=False):
+    if jobs <= 1 or len(filenames) < 2:
+        return [read_module_file(filename, strict) for filename in filenames]
+
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    # hand out work in batches, to keep inter-process overhead down.
+    chunksize = max(1, len(filenames) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(partial(read_module_file, strict=strict), filenames, chunksize=chunksize))
+
+
+def stream_module_specifiers(filenames, jobs=1, cache=None, strict=False, window=None, batch_size=64):
+    """
+    Like read_all_module_specifiers(), but takes any iterable of filenames,
+    and yields (filename, specifiers) in the same order while reading.
+    Worker processes get batch_size files at a time, and at most window
+    batches are being read at any time, so neither the filenames nor the
+    sources of a whole tree are ever held at once. Specifiers are returned
+    as tuples of interned strings.
+    """
+    def compact(specifiers):
+        return tuple(sys.intern(specifier) for specifier in specifiers)
+
+    def lookup(filename):
+        return cache.lookup(filename) if cache is not None else None
+
+    if jobs <= 1:
+        for filename in filenames:
+            specifiers = lookup(filename)
+            if specifiers is None:
+                specifiers, digest = read_module_file(filename, strict)
+                if cache is not None:
+                    cache.store(filename, specifiers, digest)
+            yield filename, compact(specifiers)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if window is None:
+        window = jobs * 4
+
+    def collect(batch, future):
+        # the files of a batch, with the cached or freshly read specifiers.
+        results = iter(future.result()) if future is not None else None
+        for filename, specifiers in batch:
+            if specifiers is None:
+                specifiers, digest = next(results)
+                if cache is not None:
+                    cache.store(filename, specifiers, digest)
+            yield filename, compact(specifiers)
+
+    # (batch, future) in order, where batch is a list of (filename, cached
+    # specifiers or None), and future reads the files which weren't cached.
+    pending = deque()
+    batch = []
+    unread = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        def submit():
+            future = executor.submit(read_module_files, unread[:], 1, strict) if unread else None
+            pending.append((batch[:], future))
+            del batch[:], unread[:]
+
+        for filename in filenames:
+            specifiers = lookup(filename)
+            batch.append((filename, specifiers))
+            if specifiers is None:
+                unread.append(filename)
+            if len(batch) < batch_size:
+                continue
+            submit()
+
+            # hand out finished batches, and wait for the oldest one while
+            # the window is full.
+            while pending and (len(pending) >= window or pending[0][1] is None or pending[0][1].done()):
+                for result in collect(*pending.popleft()):
+                    yield result
+
+        if batch:
+            submit()
+        while pending:
+            for result in collect(*pending.popleft()):
+                yield result
+
+
+def apply_declared_module_dependencies(modules, jobs=1, cache=None, strict=False, resolver=None):
+    # pull in dependencies declared in TS-files.
+    # requires real files, so cannot be used in test!
+    filenames = [module.filename for module in modules]
+    specifiers = read_all_module_specifiers(filenames, jobs, cache, strict)
+    for module, module_specifiers in zip(modules, specifiers):
+        module.apply_module_specifiers(module_specifiers, resolver)
+
+
+class ParseCache(object):
+    """
+    Persistent cache of the module-specifiers found in each file, so that
+    unchanged files don't have to be read or parsed again.
+
+    Entries are validated by file size and modification time. If only the
+    modification time differs, the file contents are hashed and compared
+    before the entry is discarded.
+
+    The whole cache is invalidated when the parser changes, through
+    PARSER_VERSION and the parser's regular expressions, or when it is
+    used with a different parser-mode.
+    """
+
+    filename = "imports.json"
+
+    def __init__(self, directory, strict=False):
+        self.directory = directory
+        self.path = os.path.join(directory, self.filename)
+        self.stamp = get_parser_stamp(strict)
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.hash_hits = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get("version") != self.stamp:
+            debug("Info: Discarding parse-cache from older version of tsviz.")
+            self.dirty = True
+            return
+        self.entries = data.get("files", {})
+
+    def clear(self):
+        self.entries = {}
+        self.dirty = True
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def lookup(self, filename):
+        # returns cached specifiers, or None if filename must be parsed.
+        self.seen.add(filename)
+        entry = self.entries.get(filename)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        size, mtime, digest, specifiers = entry
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            self.misses += 1
+            return None
+
+        if stat.st_size != size:
+            self.misses += 1
+            return None
+
+        if stat.st_mtime_ns != mtime:
+            # touched, but maybe not modified.
+            with open(filename, 'rb') as f:
+                if get_digest(f.read()) != digest:
+                    self.misses += 1
+                    return None
+            entry[1] = stat.st_mtime_ns
+            self.dirty = True
+            self.hash_hits += 1
+
+        self.hits += 1
+        return specifiers
+
+    def store(self, filename, specifiers, digest):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        self.entries[filename] = [stat.st_size, stat.st_mtime_ns, digest, specifiers]
+        self.seen.add(filename)
+        self.dirty = True
+
+    def save(self):
+        # forget files which no longer exist.
+        for filename in list(self.entries):
+            if filename not in self.seen and not os.path.exists(filename):
+                del self.entries[filename]
+                self.dirty = True
+
+        if not self.dirty:
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = {"version": self.stamp, "files": self.entries}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+    def get_statistics(self):
+        return "Parse-cache: {0} hits ({1} after hashing), {2} misses.".format(self.hits, self.hash_hits, self.misses)
+
+
+def get_parser_stamp(strict=False):
+    parser = "\n".join([
+        str(PARSER_VERSION),
+        "strict" if strict else "",
+        lexer_skip_pattern,
+        lexer_token.pattern,
+        lexer_import_declaration.pattern,
+        lexer_export_declaration.pattern,
+        lexer_require_call.pattern,
+    ])
+    return get_digest(parser.encode("utf-8"))
+
+
+def get_loose_name(filename):
+    return os.path.basename(filename).lower()
+
+
+def get_missing_module_id(name):
+    # missing modules are tracked without dashes in their names.
+    return name.replace("-", "")
+
+
+class ModuleRegistry(object):
+    """
+    Wraps a list of modules with hash-indexes on filename and loose name
+    (lower-cased basename), so that dependencies can be resolved without
+    scanning the whole list for every import.
+
+    Modules added through the registry are appended to the wrapped list too,
+    and can also be found by the name they were looked up as, so every
+    missing module gets one placeholder. When several modules share a key, the first one in list-order wins, just
+    like a linear scan would.
+
+    loose and base_path configure how dependencies are resolved, and
+    default to the module-level settings.
+    """
+
+    def __init__(self, modules=None, loose=None, base_path=None):
+        if modules is None:
+            modules = []
+        if loose is None:
+            loose = allow_loose_module_match
+        self.modules = modules
+        self.loose = loose
+        self.base_path = base_path
+        self.by_filename = {}
+        self.by_loose_name = {}
+        for module in modules:
+            self.index(module)
+
+    def index(self, module):
+        self.by_filename.setdefault(module.filename, module)
+        self.by_loose_name.setdefault(get_loose_name(module.filename), module)
+
+    def add(self, module, name=None):
+        # name is what module was looked up as, if not its filename.
+        self.modules.append(module)
+        self.index(module)
+        if name is not None:
+            self.by_filename.setdefault(name, module)
+
+    def get_by_filename(self, filename):
+        return self.by_filename.get(filename)
+
+    def get_by_loose_name(self, name):
+        return self.by_loose_name.get(get_loose_name(name))
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self):
+        return len(self.modules)
+
+
 def get_module_by_filename(filename, modules):
+    if isinstance(modules, ModuleRegistry):
+        return modules.get_by_filename(filename)
     for module in modules:
         if module.filename == filename:
             return module
@@ -227,29 +892,768 @@ def get_module_by_filename(filename, modules):
 
 
 def get_module_by_loose_name(name, modules):
-    basename = os.path.basename(name).lower()
+    if isinstance(modules, ModuleRegistry):
+        return modules.get_by_loose_name(name)
+    basename = get_loose_name(name)
     for module in modules:
-        if os.path.basename(module.filename).lower() == basename:
+        if get_loose_name(module.filename) == basename:
             return module
     return None
 
 
-def get_lines_from_file(file):
-    with open(file, 'r', encoding="utf-8") as f:
-        contents = f.read()
+# extensions tried, after the project's own, when resolving module-specifiers.
+resolver_extensions = [".ts", ".tsx", ".d.ts", ".js", ".jsx"]
+
+# tsconfig.json allows comments and trailing commas.
+json_comment_pattern = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|,(?=\s*[}\]])', re.DOTALL)
+
+
+def read_json_with_comments(filename):
+    with open(filename, "r", encoding="utf-8-sig") as f:
+        txt = f.read()
+    return json.loads(json_comment_pattern.sub(lambda match: match.group(1) or "", txt))
+
+
+def read_tsconfig(filename, seen=None):
+    """
+    Reads baseUrl and paths from the compilerOptions of a tsconfig.json,
+    following relative "extends". Returns (base_url, paths) where base_url
+    is an absolute directory or None, and paths is a list of
+    (prefix, suffix, targets) tuples. prefix and suffix are the parts of a
+    pattern around its "*", and targets are absolute path-templates.
+    """
+    filename = os.path.abspath(filename)
+    if seen is None:
+        seen = []
+    if filename in seen:
+        return None, []
+    seen.append(filename)
+
+    try:
+        config = read_json_with_comments(filename)
+    except (OSError, ValueError) as e:
+        print("WARNING: Unable to read {0}: {1}".format(filename, e))
+        return None, []
+
+    base_url = None
+    paths = []
+    config_dir = os.path.dirname(filename)
+
+    extends = config.get("extends")
+    if isinstance(extends, str) and extends.startswith("."):
+        extended = os.path.join(config_dir, extends)
+        if not extended.endswith(".json") and not os.path.isfile(extended):
+            extended += ".json"
+        base_url, paths = read_tsconfig(extended, seen)
+
+    options = config.get("compilerOptions") or {}
+    if "baseUrl" in options:
+        base_url = os.path.abspath(os.path.join(config_dir, options["baseUrl"]))
+
+    if "paths" in options:
+        # paths are relative to baseUrl, or to the tsconfig.json declaring them.
+        paths_dir = base_url or config_dir
+        paths = []
+        for pattern, targets in options["paths"].items():
+            prefix, star, suffix = pattern.partition("*")
+            if not star:
+                suffix = None
+            targets = [os.path.join(paths_dir, target) for target in targets]
+            paths.append((prefix, suffix, targets))
+
+    return base_url, paths
+
+
+def find_tsconfig(root_dir):
+    filename = os.path.join(root_dir, "tsconfig.json")
+    if os.path.isfile(filename):
+        return filename
+    return None
+
+
+class StatCache(object):
+    """
+    Remembers which files exist, so every path is checked on the
+    filesystem at most once. Files found while walking the source tree
+    can be added up front, so they never need checking.
+    """
+
+    def __init__(self, filenames=None):
+        self.files = {}
+        self.checks = 0
+        for filename in filenames or []:
+            self.files[os.path.abspath(filename)] = True
+
+    def is_file(self, filename):
+        result = self.files.get(filename)
+        if result is None:
+            self.checks += 1
+            result = os.path.isfile(filename)
+            self.files[filename] = result
+        return result
+
+
+class ModuleResolver(object):
+    """
+    Resolves module-specifiers to the filenames of the modules they refer
+    to, roughly the way the typescript compiler does: using baseUrl and
+    paths from tsconfig.json, and trying other extensions and index-files
+    when the specifier doesn't point to a file directly.
+
+    Results are memoized per (importing directory, specifier). Specifiers
+    which can't be resolved get the same names as before this resolver
+    existed, so they show up as missing modules in the graph.
+    """
+
+    def __init__(self, filenames=None, tsconfig=None, stat_cache=None, module_extension=None, packages=None):
+        if module_extension is None:
+            module_extension = extension
+        self.extension = module_extension
+        self.extensions = tuple([module_extension] + [ext for ext in resolver_extensions if ext != module_extension])
+        self.stat_cache = stat_cache or StatCache(filenames)
+        self.resolved = {}
+
+        self.base_url = None
+        self.paths = []
+        if tsconfig:
+            self.base_url, self.paths = read_tsconfig(tsconfig)
+
+        # (name, directory) of workspace packages, which bare specifiers
+        # resolve to before being treated as npm-modules.
+        self.packages = packages or []
+        self.package_entries = {}
+
+        # names of the npm-modules which couldn't be resolved. They aren't
+        # part of the source tree, so checks don't report them as missing.
+        self.external = set()
+
+    def resolve(self, directory, specifier):
+        key = (directory, specifier)
+        result = self.resolved.get(key)
+        if result is None:
+            result = sys.intern(self.resolve_specifier(directory, specifier))
+            self.resolved[key] = result
+        return result
+
+    def resolve_specifier(self, directory, specifier):
+        if specifier.startswith(".") or specifier.startswith("/"):
+            result = self.find_file(os.path.abspath(os.path.join(directory, specifier)))
+        else:
+            result = self.resolve_package(specifier)
+            if result is None:
+                for target in self.get_path_targets(specifier):
+                    result = self.find_file(os.path.abspath(target))
+                    if result is not None:
+                        debug("Info: resolved {0} through tsconfig paths.".format(specifier))
+                        break
+            if result is None and self.base_url is not None:
+                result = self.find_file(os.path.abspath(os.path.join(self.base_url, specifier)))
+
+        if result is None:
+            result = self.get_unresolved_name(directory, specifier)
+            if not self.is_project_specifier(specifier):
+                self.external.add(result)
+        return result
+
+    def is_project_specifier(self, specifier):
+        # relative and absolute paths, tsconfig paths and workspace packages
+        # refer to the source tree. Anything else is an npm-module.
+        if specifier.startswith(".") or specifier.startswith("/"):
+            return True
+        for name, _ in self.packages:
+            if specifier == name or specifier.startswith(name + "/"):
+                return True
+        return len(self.get_path_targets(specifier)) > 0
+
+    def resolve_package(self, specifier):
+        for name, directory in self.packages:
+            if specifier == name:
+                return self.get_package_entry(directory)
+            if specifier.startswith(name + "/"):
+                path = specifier[len(name) + 1:]
+                return self.find_file(os.path.abspath(os.path.join(directory, path))) or self.find_file(os.path.abspath(os.path.join(directory, "src", path)))
+        return None
+
+    def get_package_entry(self, directory):
+        if directory not in self.package_entries:
+            self.package_entries[directory] = get_package_entry(directory, self.find_file)
+        return self.package_entries[directory]
+
+    def get_path_targets(self, specifier):
+        # an exact pattern wins, otherwise the one with the longest prefix.
+        best = None
+        for prefix, suffix, targets in self.paths:
+            if suffix is None:
+                if specifier == prefix:
+                    return targets
+            elif specifier.startswith(prefix) and specifier.endswith(suffix) and len(specifier) >= len(prefix) + len(suffix):
+                if best is None or len(prefix) > len(best[0]):
+                    best = (prefix, suffix, targets)
+
+        if best is None:
+            return []
+        prefix, suffix, targets = best
+        matched = specifier[len(prefix):len(specifier) - len(suffix)]
+        return [target.replace("*", matched, 1) for target in targets]
+
+    def find_file(self, path):
+        is_file = self.stat_cache.is_file
+        for candidate in self.get_candidates(path):
+            if is_file(candidate):
+                return candidate
+        return None
+
+    def get_candidates(self, path):
+        # a generator, since the first candidate usually exists.
+        if path.endswith(self.extensions):
+            yield path
+
+        # "./module.js" may refer to module.ts.
+        if path.endswith((".js", ".jsx")):
+            root = os.path.splitext(path)[0]
+            yield root + ".ts"
+            yield root + ".tsx"
+            yield root + ".d.ts"
+
+        for ext in self.extensions:
+            yield path + ext
+        index = os.path.join(path, "index")
+        for ext in self.extensions:
+            yield index + ext
+
+    def get_unresolved_name(self, directory, specifier):
+        # same names as Module.get_module_path() followed by Module.add_dependency().
+        if specifier.find("/") != -1:
+            specifier = os.path.abspath(os.path.join(directory, specifier))
+        if specifier.find("/") == -1 or specifier.endswith(".json"):
+            debug("Info: resolved npm-module or JSON data-file {0}.".format(specifier))
+            return specifier
+        if not specifier.endswith(self.extension):
+            specifier += self.extension
+        return specifier
+
+
+def read_package_json(directory):
+    filename = os.path.join(directory, "package.json")
+    if not os.path.isfile(filename):
+        return None
+    try:
+        return read_json_with_comments(filename)
+    except (OSError, ValueError) as e:
+        print("WARNING: Unable to read {0}: {1}".format(filename, e))
+        return None
+
+
+def get_package_entry(directory, find_file):
+    """
+    Returns the filename of the module a package is imported as, or None.
+    Sources are preferred over build-output, which isn't part of the graph.
+    """
+    package = read_package_json(directory) or {}
+    candidates = [package.get("source"), "src/index", "index"]
+    candidates += [package.get(field) for field in ("types", "typings", "main", "module")]
+    for candidate in candidates:
+        if not isinstance(candidate, str):
+            continue
+        result = find_file(os.path.abspath(os.path.join(directory, candidate)))
+        if result is not None:
+            return result
+    return None
+
+
+def find_workspace_packages(root_dir):
+    """
+    Returns (name, directory) of every package declared through the
+    "workspaces" of the package.json in root_dir, sorted by directory.
+    Patterns starting with "!" exclude packages.
+    """
+    import glob
+
+    package = read_package_json(root_dir) or {}
+    workspaces = package.get("workspaces") or []
+    if isinstance(workspaces, dict):
+        workspaces = workspaces.get("packages") or []
+
+    directories = set()
+    excluded = set()
+    for pattern in workspaces:
+        found = excluded if pattern.startswith("!") else directories
+        for directory in glob.glob(os.path.join(root_dir, pattern.lstrip("!")), recursive=True):
+            found.add(os.path.normpath(directory))
+
+    packages = []
+    for directory in sorted(directories - excluded):
+        package = read_package_json(directory)
+        if package is None:
+            continue
+        name = package.get("name") or os.path.basename(directory)
+        packages.append((name, directory))
+    return packages
+
+
+class DependencyGraph(object):
+    """
+    Integer-indexed view of a module-graph.
+
+    Modules are numbered in list-order, and edges are kept as one array of
+    32-bit node-ids per node. Modules which are only reachable through edges are
+    numbered after the listed ones.
+
+    By default the graph follows dependant_modules (the edges visualized in
+    the graph). With declared=True, it follows declared_dependant_modules.
+    """
+
+    def __init__(self, modules, declared=False):
+        self.modules = []
+        self.ids = {}
+        self.edges = []
+        self.components = None
+        self.component_of = None
+        self.cyclic_components = None
+        self.component_descendants = None
+        self.reachability = None
+
+        # bytes of memory the descendant bitsets may grow the process to,
+        # or None. They grow quadratically with the graph.
+        self.max_memory = None
+
+        for module in modules:
+            self.get_id(module)
+
+        # new modules may get numbered while we go.
+        node = 0
+        while node < len(self.modules):
+            module = self.modules[node]
+            if declared:
+                deps = module.declared_dependant_modules
+            else:
+                deps = module.dependant_modules
+            self.edges[node] = array("i", [self.get_id(dep) for dep in deps])
+            node += 1
+
+    def get_id(self, module):
+        node = self.ids.get(module)
+        if node is None:
+            node = len(self.modules)
+            self.ids[module] = node
+            self.modules.append(module)
+            self.edges.append([])
+        return node
+
+    def __len__(self):
+        return len(self.modules)
+
+    def get_components(self):
+        """
+        Returns the strongly connected components of the graph, as lists of
+        node-ids, in reverse topological order: a component is always listed
+        after all components it depends on.
+
+        Uses Tarjan's algorithm, iteratively to avoid recursion limits on
+        deep graphs. Result is computed once and cached.
+        """
+        if self.components is not None:
+            return self.components
+
+        edges = self.edges
+        count = len(edges)
+        index = [-1] * count
+        lowlink = [0] * count
+        position = [0] * count
+        on_stack = [False] * count
+        stack = []
+        components = []
+        component_of = [0] * count
+        next_index = 0
+
+        for root in range(count):
+            if index[root] != -1:
+                continue
+
+            index[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [root]
+
+            while work:
+                node = work[-1]
+                succ = edges[node]
+                pos = position[node]
+                if pos < len(succ):
+                    position[node] = pos + 1
+                    dep = succ[pos]
+                    if index[dep] == -1:
+                        index[dep] = lowlink[dep] = next_index
+                        next_index += 1
+                        stack.append(dep)
+                        on_stack[dep] = True
+                        work.append(dep)
+                    elif on_stack[dep] and index[dep] < lowlink[node]:
+                        lowlink[node] = index[dep]
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+
+                if lowlink[node] == index[node]:
+                    component_id = len(components)
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component_of[member] = component_id
+                        component.append(member)
+                        if member == node:
+                            break
+                    component.reverse()
+                    components.append(component)
+
+        # a component is circular if it has more than one member, or if its
+        # only member depends on itself.
+        cyclic_components = []
+        for component in components:
+            node = component[0]
+            cyclic_components.append(len(component) > 1 or node in edges[node])
+
+        self.components = components
+        self.component_of = component_of
+        self.cyclic_components = cyclic_components
+        return components
+
+    def get_component_descendants(self):
+        """
+        Returns, for every component, the set of components reachable from
+        it as an integer bitset (bit n set means component n is reachable).
+
+        A component is only part of its own set when it is circular.
+        Computed once, in reverse topological order, and cached.
+        """
+        if self.component_descendants is not None:
+            return self.component_descendants
+
+        components = self.get_components()
+        component_of = self.component_of
+        edges = self.edges
+        descendants = []
+
+        for component_id, component in enumerate(components):
+            reachable = 0
+            for node in component:
+                for dep in edges[node]:
+                    dep_component = component_of[dep]
+                    if dep_component != component_id:
+                        reachable |= (1 << dep_component) | descendants[dep_component]
+            if self.cyclic_components[component_id]:
+                reachable |= 1 << component_id
+            descendants.append(reachable)
+            if self.max_memory is not None and component_id % 1024 == 0:
+                check_memory(self.max_memory)
+
+        self.component_descendants = descendants
+        return descendants
+
+    def get_circular_components(self):
+        components = self.get_components()
+        return [
+            component
+            for component_id, component in enumerate(components)
+            if self.cyclic_components[component_id]
+        ]
+
+    def get_reachability(self):
+        if self.reachability is None:
+            self.reachability = ReachabilityIndex(self)
+        return self.reachability
+
+
+class ReachabilityIndex(object):
+    """
+    Answers "does A depend on B?" for a whole module-graph, using the
+    per-component descendant bitsets of a DependencyGraph. Built on first
+    use through DependencyGraph.get_reachability(), since the bitsets grow
+    quadratically with the graph, and shared by --why, highlighting and
+    queries. Each test shifts or masks a bitset as wide as the graph, and
+    listing dependencies or dependants scans every module.
+
+    Transitive dependency elimination doesn't change which modules can
+    reach which, so an index built on declared dependencies remains valid
+    after it.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.descendants = graph.get_component_descendants()
+        self.component_of = graph.component_of
+        self.highlighted_components = None
+
+    def get_component(self, module):
+        return self.component_of[self.graph.ids[module]]
+
+    def contains(self, module):
+        return module in self.graph.ids
+
+    def depends_on(self, module, dependency):
+        """
+        True if module depends on dependency, directly or transitively.
+        """
+        component = self.get_component(module)
+        dep_component = self.get_component(dependency)
+        return (self.descendants[component] >> dep_component) & 1 == 1
+
+    def is_dependency_of(self, module, dependant):
+        return self.depends_on(dependant, module)
+
+    def get_dependencies(self, module):
+        component = self.get_component(module)
+        reachable = self.descendants[component]
+        return [
+            dep
+            for dep in self.graph.modules
+            if (reachable >> self.get_component(dep)) & 1
+        ]
+
+    def get_dependants(self, module):
+        component = self.get_component(module)
+        return [
+            dependant
+            for dependant in self.graph.modules
+            if (self.descendants[self.get_component(dependant)] >> component) & 1
+        ]
+
+    def get_highlighted_components(self):
+        # cached, since highlights are only set once per run.
+        # call reset_highlights() if they change.
+        if self.highlighted_components is None:
+            highlighted = 0
+            for module in self.graph.modules:
+                if module.highlight:
+                    highlighted |= 1 << self.get_component(module)
+            self.highlighted_components = highlighted
+        return self.highlighted_components
+
+    def reset_highlights(self):
+        self.highlighted_components = None
+
+    def has_highlighted_dependencies(self, module):
+        component = self.get_component(module)
+        return self.descendants[component] & self.get_highlighted_components() != 0
+
+    def get_path(self, module, dependency):
+        """
+        Returns one shortest chain of declared dependencies leading from
+        module to dependency, including both ends, or None if module doesn't
+        depend on dependency.
+        """
+        if module is dependency:
+            return [module]
+        if not self.depends_on(module, dependency):
+            return None
+
+        graph = self.graph
+        descendants = self.descendants
+        component_of = self.component_of
+        start = graph.ids[module]
+        target = graph.ids[dependency]
+        target_component = component_of[target]
+
+        # breadth first, only following modules which can lead to the target.
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for dep in graph.edges[node]:
+                if dep in previous:
+                    continue
+                if dep != target and not (descendants[component_of[dep]] >> target_component) & 1:
+                    continue
+                previous[dep] = node
+                if dep == target:
+                    path = []
+                    while dep is not None:
+                        path.append(graph.modules[dep])
+                        dep = previous[dep]
+                    path.reverse()
+                    return path
+                queue.append(dep)
+
+        return None
+
+
+# int.bit_count() is only available from python 3.10.
+popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+
+def get_graph_metrics(graph):
+    """
+    Computes dependency metrics for every module in a DependencyGraph, in
+    node order: fan-in and fan-out, the number of modules it depends on
+    and which depend on it (directly or transitively), its layer (the
+    longest chain of dependencies below it, 0 for modules without any)
+    and the size of its strongly connected component. circular_groups
+    lists the sizes of all groups of circular dependencies, largest first.
+
+    Transitive counts are taken from the per-component bitsets in one
+    pass over the condensed graph, rather than walking the dependencies
+    of every module.
+    """
+    import itertools
+    from collections import Counter
+
+    components = graph.get_components()
+    component_of = graph.component_of
+    cyclic = graph.cyclic_components
+    edges = graph.edges
+    descendants = graph.get_component_descendants()
+    sizes = [len(component) for component in components]
+
+    # dependencies between components, and the inverse.
+    successors = []
+    predecessors = [[] for _ in components]
+    for component_id, component in enumerate(components):
+        deps = set(component_of[dep] for node in component for dep in edges[node])
+        deps.discard(component_id)
+        successors.append(deps)
+        for dep in deps:
+            predecessors[dep].append(component_id)
+
+    # components are in reverse topological order: dependencies first.
+    layers = []
+    for component_id in range(len(components)):
+        layers.append(max([layers[dep] + 1 for dep in successors[component_id]] or [0]))
+
+    ancestors = [0] * len(components)
+    for component_id in reversed(range(len(components))):
+        reaching = 1 << component_id if cyclic[component_id] else 0
+        for dependant in predecessors[component_id]:
+            reaching |= (1 << dependant) | ancestors[dependant]
+        ancestors[component_id] = reaching
+
+    # bitsets count components. circular ones hold more than one module,
+    # so their extra modules are counted through one mask per size.
+    masks = {}
+    for component_id, size in enumerate(sizes):
+        if size > 1:
+            masks[size] = masks.get(size, 0) | (1 << component_id)
+    masks = [(size - 1, mask) for size, mask in masks.items()]
+
+    def count_modules(bitset, component_id):
+        count = popcount(bitset) + sum(extra * popcount(bitset & mask) for extra, mask in masks)
+        # a circular module reaches itself.
+        return count - 1 if cyclic[component_id] else count
+
+    dependency_counts = [count_modules(bitset, component_id) for component_id, bitset in enumerate(descendants)]
+    dependant_counts = [count_modules(bitset, component_id) for component_id, bitset in enumerate(ancestors)]
+    del ancestors
+
+    fan_in = Counter(itertools.chain.from_iterable(edges))
+    nodes = range(len(graph.modules))
+    return {
+        "modules": [module.name for module in graph.modules],
+        "fan_in": [fan_in[node] for node in nodes],
+        "fan_out": [len(edges[node]) for node in nodes],
+        "dependencies": [dependency_counts[component_of[node]] for node in nodes],
+        "dependants": [dependant_counts[component_of[node]] for node in nodes],
+        "layer": [layers[component_of[node]] for node in nodes],
+        "component_size": [sizes[component_of[node]] for node in nodes],
+        "circular_groups": sorted((sizes[component_id] for component_id in range(len(components)) if cyclic[component_id]), reverse=True),
+    }
+
+
+def get_metrics_report(metrics, top=10):
+    """
+    Summarizes metrics from get_graph_metrics(), with the top modules by
+    each metric.
+    """
+    names = metrics["modules"]
+    count = len(names)
+    circular_sizes = metrics["circular_groups"]
+
+    lines = [
+        "modules:              {0}".format(count),
+        "dependencies:         {0}".format(sum(metrics["fan_out"])),
+        "layers:               {0}".format(max(metrics["layer"]) + 1 if count else 0),
+        "circular groups:      {0}".format(len(circular_sizes)),
+        "largest circular:     {0}".format(", ".join(str(size) for size in circular_sizes[:top]) or "-"),
+    ]
+
+    # centrality: the number of dependency chains passing through a module.
+    centrality = [dependants * dependencies for dependants, dependencies in zip(metrics["dependants"], metrics["dependencies"])]
+    rankings = [
+        ("most depended upon", metrics["dependants"]),
+        ("most central (dependants x dependencies)", centrality),
+        ("highest fan-in", metrics["fan_in"]),
+        ("highest fan-out", metrics["fan_out"]),
+        ("most dependencies", metrics["dependencies"]),
+    ]
+    for title, values in rankings:
+        lines.append("")
+        lines.append("{0}:".format(title))
+        ranked = sorted(range(count), key=lambda node: (-values[node], names[node]))[:top]
+        for node in ranked:
+            lines.append("  {0:>8}  {1}".format(values[node], names[node]))
+    return "\n".join(lines)
+
+
+def detect_circular_dependencies(modules, graph=None):
+    """
+    Flags all modules taking part in circular dependencies, using one pass
+    over the strongly connected components of the declared module-graph.
+
+    A module's circular_dependencies are the modules it is declared as a
+    dependency of, within its own component.
+    """
+    if graph is None:
+        graph = DependencyGraph(modules, declared=True)
 
-        # detect byte order marker. messes up first line in file.
-        # this first line is often an import!
+    for component in graph.get_circular_components():
+        names = sorted(graph.modules[node].name for node in component)
+        print("WARNING: Circular dependency detected! Modules {0} depends on each other!".format(", ".join(names)))
 
-        bytes = contents.encode('utf-8')
-        #print(bytes[0:3])
-        if bytes[0:2] == b'\xef\xff':
-            print("BOM detected!")
-            contents = contents[2:]
+    component_of = graph.component_of
+    cyclic_components = graph.cyclic_components
+    for node, deps in enumerate(graph.edges):
+        component_id = component_of[node]
+        if not cyclic_components[component_id]:
+            continue
+        module = graph.modules[node]
+        for dep in deps:
+            if component_of[dep] == component_id:
+                dep_module = graph.modules[dep]
+                dep_module.has_circular_dependencies = True
+                dep_module.circular_dependencies.append(module)
 
-        if bytes[0:2] == b'\xef\xbb':
-            #print("BOM (3-byte) detected!")
-            contents = contents[1:]
+    return graph
+
+
+def get_source_from_bytes(data):
+    contents = data.decode("utf-8")
+
+    # same newline-handling as reading the file in text-mode.
+    contents = contents.replace("\r\n", "\n").replace("\r", "\n")
+
+    # detect byte order marker. messes up first line in file.
+    # this first line is often an import!
+
+    bytes = contents.encode('utf-8')
+    #print(bytes[0:3])
+    if bytes[0:2] == b'\xef\xff':
+        print("BOM detected!")
+        contents = contents[2:]
+
+    if bytes[0:2] == b'\xef\xbb':
+        #print("BOM (3-byte) detected!")
+        contents = contents[1:]
+
+    return contents
+
+
+def get_lines_from_file(file):
+    with open(file, 'rb') as f:
+        contents = get_source_from_bytes(f.read())
 
         lines = contents.split("\n")
         # print(lines[0])
@@ -261,54 +1665,499 @@ def sort_modules(modules):
     modules.sort(key=lambda x: x.name)
 
 
-def get_tsfiles_in_dir(root_dir):
-    global extension
-    from fnmatch import fnmatch
+# directories which never contain sources we want to graph.
+ignored_directory_names = ["node_modules", ".git", "dist", cache_directory_name]
+
+
+def read_ignore_rules(filename, base):
+    """
+    Reads the patterns of a .gitignore-file as (base, pattern, negate, dir_only, anchored)
+    tuples. Supports comments, negation, trailing slashes for directories, and patterns
+    anchored to the directory of the .gitignore-file. Globs are matched with fnmatch.
+    """
+    try:
+        with open(filename, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line.startswith("**/"):
+            line = line[3:]
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            continue
+
+        rules.append((base, line, negate, dir_only, anchored))
+    return rules
+
+
+def is_ignored(rules, path, name, is_dir):
+    """
+    Checks a path, relative to the root directory, against .gitignore rules.
+    Like git, the last matching rule wins.
+    """
+    from fnmatch import fnmatchcase
+
+    ignored = False
+    for base, pattern, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if anchored:
+            matched = fnmatchcase(path[len(base) + 1:] if base else path, pattern)
+        else:
+            matched = fnmatchcase(name, pattern)
+        if matched:
+            ignored = not negate
+    return ignored
 
-    results = []
 
-    for path, subdirs, files in os.walk(root_dir):
-        for name in files:
-            if fnmatch(name, "*" + extension):
-                results.append(os.path.join(path, name))
+def find_source_files(root_dir, exclude=None, use_ignores=True, module_extension=".ts"):
+    """
+    Finds all source files below root_dir in a single pass, in the same order as
+    os.walk. Falls back to .js-files if there are no module_extension-files.
+    Returns the files found, and the extension they have.
+
+    Directories matching the exclude-expression, well known output-directories
+    and paths ignored by .gitignore-files are skipped without being descended into.
+    """
+    found = list(walk_source_files(root_dir, exclude, use_ignores, module_extension))
+    if found:
+        return [filename for filename, _ in found], found[0][1]
 
     # fallback to JS if no typescript
-    if results == []:
-        extension = ".js"
-        for path, subdirs, files in os.walk(root_dir):
-            for name in files:
-                if fnmatch(name, "*" + extension):
-                    results.append(os.path.join(path, name))
+    if module_extension != fallback_extension:
+        return [], fallback_extension
+    return [], module_extension
+
+
+fallback_extension = ".js"
+
+
+def walk_source_files(root_dir, exclude=None, use_ignores=True, module_extension=".ts"):
+    """
+    Like find_source_files(), but yields (filename, extension) as files
+    are found, so that they can be processed while walking. .js-files are
+    only remembered until the first module_extension-file is found.
+    """
+    fallback = fallback_extension
+    fallback_results = []
+    found_any = False
+
+    # depth-first, like os.walk. every entry is (directory, relative path, ignore-rules).
+    pending = [(root_dir, "", [])]
+    while pending:
+        path, relative_path, rules = pending.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        if use_ignores:
+            for entry in entries:
+                if entry.name == ".gitignore" and entry.is_file():
+                    rules = rules + read_ignore_rules(entry.path, relative_path)
+                    break
+
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            child_path = relative_path + "/" + name if relative_path else name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # like os.walk, don't follow symlinks to directories.
+                if entry.is_symlink():
+                    continue
+                if use_ignores:
+                    if name in ignored_directory_names or is_ignored(rules, child_path, name, True):
+                        continue
+                if exclude and exclude.match(str.lower(os.path.abspath(entry.path) + os.sep)):
+                    continue
+                subdirs.append((entry.path, child_path, rules))
+                continue
+
+            if name.endswith(module_extension):
+                is_fallback = False
+            elif name.endswith(fallback) and not found_any:
+                is_fallback = True
+            else:
+                continue
+            if use_ignores and rules and is_ignored(rules, child_path, name, False):
+                continue
+
+            filename = os.path.join(path, name)
+            if is_fallback:
+                fallback_results.append(filename)
+            else:
+                found_any = True
+                fallback_results = []
+                yield filename, module_extension
+
+        pending.extend(reversed(subdirs))
+
+    if not found_any and module_extension != fallback:
+        for filename in fallback_results:
+            yield filename, fallback
+
+
+def get_tsfiles_in_dir(root_dir, exclude=None, use_ignores=True):
+    # like find_source_files(), but remembers the extension found for
+    # the module-level functions.
+    global extension
+
+    results, extension = find_source_files(root_dir, exclude, use_ignores, extension)
     return results
 
 
-def get_modules(tsfiles):
+def get_modules(tsfiles, base_path=None):
 
     modules = []
     for tsfile in tsfiles:
-        modules.append(Module(tsfile))
+        modules.append(Module(tsfile, base_path))
     return modules
 
 
-def process_modules(modules):
+def read_workspace_package(directory, packages, exclude=None, module_extension=".ts", strict=False, use_ignores=True, cache_dir=None):
+    """
+    Finds and reads the sources of one workspace package. Returns the
+    files found, the module-specifiers of each of them, and whether the
+    result came from the cache.
+
+    Packages nested in directory are left to themselves. Specifiers are
+    cached unresolved, since what they resolve to depends on the other
+    packages too, and are used when no source file or the parser changed.
+    Self-contained, so that it can run in a worker-process.
+    """
+    nested = [
+        re.escape(str.lower(os.path.abspath(other) + os.sep))
+        for _, other in packages
+        if other != directory and os.path.abspath(other).startswith(os.path.abspath(directory) + os.sep)
+    ]
+    if exclude:
+        nested.append("(?:{0})".format(exclude))
+    excluder = re.compile("|".join(nested)) if nested else None
+
+    files, _ = find_source_files(directory, excluder, use_ignores, module_extension)
+    if excluder:
+        files = [file for file in files if not excluder.match(str.lower(os.path.abspath(file)))]
+
+    cache_file = None
+    if cache_dir is not None:
+        stats = []
+        for file in files:
+            try:
+                stat = os.stat(file)
+                stats.append([file, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                stats.append([file])
+        signature = get_digest(json.dumps([get_parser_stamp(strict), module_extension, stats]).encode("utf-8"))
+        cache_file = os.path.join(cache_dir, get_digest(os.path.abspath(directory).encode("utf-8")) + ".json")
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("signature") == signature:
+                return data["files"], data["specifiers"], True
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    specifiers = [read_module_specifiers(file, strict) for file in files]
+
+    if cache_file is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        temp_path = "{0}.{1}.tmp".format(cache_file, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": signature, "files": files, "specifiers": specifiers}, f, separators=(",", ":"))
+        os.replace(temp_path, cache_file)
+
+    return files, specifiers, False
+
+
+def read_workspace_packages(packages, jobs=1, exclude=None, module_extension=".ts", strict=False, use_ignores=True, cache_dir=None):
+    """
+    Runs read_workspace_package() for every package, using a pool of jobs
+    worker processes if jobs > 1. Results are returned in package order.
+    """
+    from functools import partial
+
+    read = partial(read_workspace_package, packages=packages, exclude=exclude, module_extension=module_extension, strict=strict, use_ignores=use_ignores, cache_dir=cache_dir)
+    directories = [directory for _, directory in packages]
+    if jobs <= 1 or len(directories) < 2:
+        return [read(directory) for directory in directories]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(read, directories))
+
+
+def get_peak_memory():
+    """
+    Returns the peak resident set size of this process so far, in bytes,
+    or None where the resource module isn't available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but on macOS.
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def get_current_memory():
+    """
+    Returns the resident set size of this process, in bytes. Where it
+    can't be read from /proc, the peak resident set size is used instead,
+    and None is returned where neither is available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return get_peak_memory()
+
+
+def check_memory(max_memory):
+    memory = get_current_memory()
+    if memory is not None and memory > max_memory:
+        raise MemoryError("Using {0} MB, more than the limit of {1} MB".format(memory // (1024 * 1024), max_memory // (1024 * 1024)))
+
+
+class PhaseTimings(object):
+    """
+    Collects wall time, CPU time, peak memory and item counts for every
+    phase of a run.
+
+    Hooks added with add_hook() are called with the name and metrics of
+    each phase as soon as it ends, so library callers can forward them
+    elsewhere. CPU time and peak memory only cover this process, not
+    --jobs worker processes.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        import time
+
+        metrics = {"name": name, "items": None}
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        yield metrics
+        metrics["wall"] = time.perf_counter() - wall
+        metrics["cpu"] = time.process_time() - cpu
+        metrics["peak_memory"] = get_peak_memory()
+
+        self.phases.append(metrics)
+        for hook in self.hooks:
+            hook(name, metrics)
+
+    def get_totals(self):
+        return {
+            "wall": sum(metrics["wall"] for metrics in self.phases),
+            "cpu": sum(metrics["cpu"] for metrics in self.phases),
+            "peak_memory": get_peak_memory(),
+        }
+
+    def get_report(self):
+        lines = ["{0:<14}{1:>10}{2:>10}{3:>12}{4:>10}".format("phase", "wall (s)", "cpu (s)", "peak (MB)", "items")]
+
+        def format_line(name, metrics):
+            peak = metrics["peak_memory"]
+            items = metrics.get("items")
+            return "{0:<14}{1:>10.3f}{2:>10.3f}{3:>12}{4:>10}".format(
+                name,
+                metrics["wall"],
+                metrics["cpu"],
+                "-" if peak is None else "{0:.1f}".format(peak / 1048576.0),
+                "-" if items is None else items
+            )
+
+        for metrics in self.phases:
+            lines.append(format_line(metrics["name"], metrics))
+        lines.append(format_line("total", self.get_totals()))
+        return "\n".join(lines)
+
+    def to_json(self):
+        return {
+            "phases": self.phases,
+            "total": self.get_totals(),
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+def time_phase(timings, name):
+    # lets callers time phases without checking if timings are wanted.
+    if timings is None:
+        return contextlib.nullcontext({})
+    return timings.phase(name)
+
+
+def process_modules(modules, timings=None, loose=None, base_path=None):
     # all projects & dependencies should now be known. lets analyze them
-    for module in modules:
-        module.resolve_modules_from_names(modules)
+    with time_phase(timings, "resolve") as phase:
+        registry = ModuleRegistry(modules, loose, base_path)
+        for module in modules:
+            module.resolve_modules_from_names(registry)
+        phase["items"] = len(registry)
 
     # once all modules have resolved their dependencies, we can try to
     # detect ciruclar dependencies!
-    for module in modules:
-        module.detect_circular_dependencies()
+    with time_phase(timings, "cycles") as phase:
+        graph = detect_circular_dependencies(modules)
+        phase["items"] = sum(graph.cyclic_components)
 
     # format results in a alphabetical order
-    sort_modules(modules)
+    with time_phase(timings, "sort") as phase:
+        sort_modules(modules)
+        for module in modules:
+            sort_modules(module.dependant_modules)
+        phase["items"] = len(modules)
+
+    return graph
+
+
+def check_modules(modules, cycles=True, missing=True, fail_fast=False, loose=None, base_path=None, external=None):
+    """
+    Resolves the declared dependencies of modules, and returns the names
+    of the modules in each group of circular dependencies, and (module
+    name, missing module name) for every dependency which couldn't be
+    resolved, except the ones named in external. Unlike process_modules(),
+    missing modules aren't added to the graph, and nothing is printed.
+
+    With fail_fast, returns as soon as one violation is found. The
+    missing modules are checked first, since cycles can only be found
+    once all dependencies are resolved.
+    """
+    registry = ModuleRegistry(modules, loose, base_path)
+    missing_modules = []
     for module in modules:
-        sort_modules(module.dependant_modules)
+        deps = []
+        for name in module.dependant_module_names:
+            dep = registry.get_by_filename(name)
+            if dep is None and registry.loose:
+                dep = registry.get_by_loose_name(name)
+            if dep is None:
+                if missing and not (external and name in external):
+                    # named like the missing module in the graph would be.
+                    missing_modules.append((module.name, module.get_name_from_filename(get_missing_module_id(name), registry.base_path)))
+                    if fail_fast:
+                        return [], missing_modules
+                continue
+            deps.append(dep)
+        module.declared_dependant_modules = deps
+
+    circular = []
+    if cycles:
+        graph = DependencyGraph(modules, declared=True)
+        for component in graph.get_circular_components():
+            circular.append(sorted(graph.modules[node].name for node in component))
+            if fail_fast:
+                break
+    return circular, missing_modules
+
+
+# exit codes of --check-cycles and --check-missing, combined when both
+# are found.
+check_exit_cycles = 4
+check_exit_missing = 8
+
+
+def get_check_report(cycles, missing):
+    lines = []
+    for cycle in cycles:
+        # the members of a circular group, not a chain of imports.
+        lines.append("cycle: {0}".format(", ".join(cycle)))
+    for module, missing_module in missing:
+        lines.append("missing: {0} imports {1}".format(module, missing_module))
+    lines.append("{0} circular dependencies, {1} missing modules.".format(len(cycles), len(missing)))
+    return "\n".join(lines)
 
 
-def remove_transitive_dependencies(projects):
-    for project in projects:
-        project.remove_transitive_dependencies()
+def get_check_exit_code(cycles, missing):
+    code = 0
+    if cycles:
+        code |= check_exit_cycles
+    if missing:
+        code |= check_exit_missing
+    return code
+
+
+def remove_transitive_dependencies(projects, graph=None):
+    # if A depends on B & C, and
+    # B also depends on C, then
+    # A has a transitive dependency on C through B.
+
+    # works on the condensed graph, where every circular group of modules is
+    # one node: a dependency on another group is redundant if that group is
+    # also reachable through one of the other groups we depend on.
+    # dependencies within a circular group are always kept.
+
+    if graph is None:
+        graph = DependencyGraph(projects)
+
+    components = graph.get_components()
+    descendants = graph.get_component_descendants()
+    component_of = graph.component_of
+
+    for component_id, component in enumerate(components):
+        # everything reachable through at least one other group. circular
+        # groups can reach themselves, but that doesn't make them redundant.
+        redundant = 0
+        for node in component:
+            for dep in graph.edges[node]:
+                dep_component = component_of[dep]
+                if dep_component != component_id:
+                    redundant |= descendants[dep_component] & ~(1 << dep_component)
+
+        if redundant == 0:
+            continue
+
+        for node in component:
+            project = graph.modules[node]
+            project_deps = []
+            for dep in project.dependant_modules:
+                dep_component = component_of[graph.ids[dep]]
+                if dep_component != component_id and (redundant >> dep_component) & 1:
+                    debug("--Project {0}-- Removed transitive dependency: {1}".format(project.name, dep.name))
+                else:
+                    project_deps.append(dep)
+
+            eliminated_deps = len(project.dependant_modules) - len(project_deps)
+            if eliminated_deps != 0:
+                debug("--Project {0}-- Eliminated {1} transitive dependencies. Was {2}. Reduced to {3}".format(project.name, eliminated_deps, len(project.dependant_modules), len(project_deps)))
+                project.dependant_modules = project_deps
 
 
 def filter_modules(rx, projects):
@@ -323,118 +2172,1389 @@ def filter_modules(rx, projects):
     return result
 
 
-def highlight_modules(rx, projects):
+def highlight_modules(rx, projects, reachability=None):
     for project in projects:
         if rx.match(str.lower(project.name)):
             debug("Highlighting project {0}".format(project.name))
             project.highlight = True
 
+    if reachability is None:
+        reachability = DependencyGraph(projects).get_reachability()
+    reachability.reset_highlights()
+
+    # flag everything reachable from a highlighted project.
+    highlighted_deps = 0
     for project in projects:
         if project.highlight:
-            deps = project.get_nested_dependencies()
-            for dep in deps:
-                dep.highlighted_dependents = True
+            highlighted_deps |= reachability.descendants[reachability.get_component(project)]
+
+    if highlighted_deps == 0:
+        return
+
+    for dep in reachability.graph.modules:
+        if (highlighted_deps >> reachability.get_component(dep)) & 1:
+            dep.highlighted_dependents = True
+
+
+def get_neighbourhood(rx, projects, depth, upstream=True, downstream=True):
+    """
+    Returns the modules within depth hops of the modules matching rx,
+    following dependant_modules to dependencies (downstream) and/or to
+    dependants (upstream), sorted by name. Apart from matching and
+    indexing dependants, the work done is linear in the size of the result.
+    """
+    focused = [project for project in projects if rx.match(str.lower(project.name))]
+
+    dependants = None
+    if upstream:
+        dependants = {}
+        for project in projects:
+            for dep in project.dependant_modules:
+                dependants.setdefault(dep, []).append(project)
+
+    result = set(focused)
+    directions = []
+    if downstream:
+        directions.append(lambda module: module.dependant_modules)
+    if upstream:
+        directions.append(lambda module: dependants.get(module, []))
+
+    # breadth-first, one direction at a time, so that dependants of
+    # dependencies aren't included.
+    for get_neighbours in directions:
+        seen = set(focused)
+        frontier = focused
+        for _ in range(depth):
+            next_frontier = []
+            for module in frontier:
+                for neighbour in get_neighbours(module):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+            if not next_frontier:
+                break
+            result.update(next_frontier)
+            frontier = next_frontier
+
+    result = list(result)
+    sort_modules(result)
+    return result
 
 
-def render_dot_file(projects, highlight_all=False, highlight_children=False):
-    lines = []
+def focus_modules(rx, projects, depth, upstream=True, downstream=True):
+    """
+    Returns the neighbourhood of the modules matching rx, as returned by
+    get_neighbourhood(), with dependencies leading out of it removed.
+    """
+    result = get_neighbourhood(rx, projects, depth, upstream, downstream)
+    included = set(result)
+    for project in result:
+        project.dependant_modules = [dep for dep in project.dependant_modules if dep in included]
+    debug("Info: Focused on {0} of {1} projects.".format(len(result), len(projects)))
+    return result
+
+
+def find_module(expression, modules):
+    """
+    Finds a module by name: an exact (case-insensitive) match is preferred,
+    otherwise the first module, alphabetically, matching the expression.
+    """
+    name = str.lower(expression)
+    for module in modules:
+        if str.lower(module.name) == name:
+            return module
+
+    rx = re.compile(name)
+    for module in sorted(modules, key=lambda x: x.name):
+        if rx.match(str.lower(module.name)):
+            return module
+    return None
+
+
+def explain_dependency(reachability, modules, source, target):
+    """
+    Returns a human-readable explanation of why the module matching source
+    depends on the module matching target, using the shortest chain of
+    declared dependencies.
+    """
+    module = find_module(source, modules)
+    if module is None:
+        return "ERROR! No module matching {0}!".format(source)
+    dependency = find_module(target, modules)
+    if dependency is None:
+        return "ERROR! No module matching {0}!".format(target)
+
+    path = reachability.get_path(module, dependency)
+    if path is None:
+        return "{0} does not depend on {1}.".format(module.name, dependency.name)
+
+    lines = ["{0} depends on {1}:".format(module.name, dependency.name)]
+    lines.append("    {0}".format(path[0].name))
+    for dep in path[1:]:
+        lines.append(" -> {0}".format(dep.name))
+    return "\n".join(lines)
+
 
-    lines.append("digraph {")
-    lines.append("    rankdir=\"LR\"")
-    lines.append("")
-    lines.append("    # apply theme")
-    lines.append("    bgcolor=\"#222222\"")
-    lines.append("")
-    lines.append("    // defaults for edges and nodes can be specified")
-    lines.append("    node [ color=\"#ffffff\" fontcolor=\"#ffffff\" ]")
-    lines.append("    edge [ color=\"#ffffff\" ]")
-    lines.append("")
-    lines.append("    # module declarations")
+dot_file_header = """digraph {
+    rankdir="LR"
+
+    # apply theme
+    bgcolor="#222222"
+
+    // defaults for edges and nodes can be specified
+    node [ color="#ffffff" fontcolor="#ffffff" ]
+    edge [ color="#ffffff" ]
+
+    # module declarations
+"""
+
+highlighted_node_styling = " fillcolor=\"#30c2c2\" style=filled color=\"#000000\" fontcolor=\"#000000\""
+missing_node_styling = " fillcolor=\"#f22430\" style=filled color=\"#000000\" fontcolor=\"#000000\""
+has_missing_node_styling = " fillcolor=\"#616118\" style=filled color=\"#000000\" fontcolor=\"#000000\""
+circular_node_styling = " fillcolor=\"#ff0000\" style=filled color=\"#000000\" fontcolor=\"#cccc00\""
+
+highlighted_edge_styling = " [color=\"#30c2c2\"]"
+missing_edge_styling = " [color=\"#f22430\"]"
+circular_edge_styling = " [color=\"#ff0000\"]"
+
+edge_stylings = {
+    "": "",
+    "highlighted": highlighted_edge_styling,
+    "missing": missing_edge_styling,
+    "circular": circular_edge_styling,
+}
+
+
+def get_node_styles(projects, highlight_all=False, reachability=None):
+    """
+    Computes what the DOT-renderer needs to know about every module in
+    the graph, in one pass. Returns a dict of module to (id, highlighted,
+    highlighted-as-dependency, highlighted_dependents, is_missing_module,
+    has_missing_modules, has_circular_dependencies).
+    """
+    graph = DependencyGraph(projects)
+    if highlight_all and reachability is None:
+        reachability = DependencyGraph(projects, declared=True).get_reachability()
+
+    styles = {}
+    for module in graph.modules:
+        highlighted = module.highlight or module.highlighted_dependents
+        highlighted_dependency = (
+            module.highlight
+            or module.has_declared_highlighted_dependencies()
+            or (highlight_all and module.has_highlighted_dependencies(reachability))
+        )
+        styles[module] = (
+            module.get_friendly_id(),
+            highlighted,
+            highlighted_dependency,
+            module.highlighted_dependents,
+            module.is_missing_module,
+            module.has_missing_modules,
+            module.has_circular_dependencies,
+        )
+    return styles
+
+
+def get_edge_style(source_style, target_style):
+    """
+    Returns how an edge between two modules is flagged, given their
+    styles from get_node_styles(): "highlighted", "missing", "circular"
+    or "".
+    """
+    _, source_highlighted, _, _, _, source_has_missing, source_circular = source_style
+    _, _, target_highlighted, target_dependents, target_is_missing, target_has_missing, target_circular = target_style
+    if target_highlighted or (source_highlighted and target_dependents):
+        return "highlighted"
+    elif target_is_missing or (source_has_missing and target_has_missing):
+        return "missing"
+    elif source_circular and target_circular:
+        return "circular"
+    return ""
+
+
+def write_dot_file(f, projects, highlight_all=False, highlight_children=False, reachability=None):
+    """
+    Writes the graph as a DOT-file to the file-object f, one module at a
+    time, without building the whole document in memory.
+    """
+    styles = get_node_styles(projects, highlight_all, reachability)
+
+    f.write(dot_file_header)
 
     # define projects
     # create nodes like this
     #  A [ label="First Node" shape="circle" ]
     for project in projects:
-        id = project.get_friendly_id()
+        id, highlighted, _, _, is_missing, has_missing, circular = styles[project]
 
         styling = ""
-        if project.highlight or project.highlighted_dependents:
-            styling = " fillcolor=\"#30c2c2\" style=filled color=\"#000000\" fontcolor=\"#000000\""
-        elif project.is_missing_module:
-            styling = " fillcolor=\"#f22430\" style=filled color=\"#000000\" fontcolor=\"#000000\""
-        elif project.has_missing_modules:
-            styling = " fillcolor=\"#616118\" style=filled color=\"#000000\" fontcolor=\"#000000\""
-        elif project.has_circular_dependencies:
-            styling = " fillcolor=\"#ff0000\" style=filled color=\"#000000\" fontcolor=\"#cccc00\""
-
+        if highlighted:
+            styling = highlighted_node_styling
+        elif is_missing:
+            styling = missing_node_styling
+        elif has_missing:
+            styling = has_missing_node_styling
+        elif circular:
+            styling = circular_node_styling
 
-        lines.append("    {0} [ label=\"{1}\" {2} ]".format(id, project.name, styling))
+        f.write("    {0} [ label=\"{1}\" {2} ]\n".format(id, project.name, styling))
 
     # apply dependencies
-    lines.append("")
-    lines.append("    # project dependencies")
+    f.write("\n    # project dependencies\n")
     for project in projects:
-        proj1_id = project.get_friendly_id()
+        proj1_style = styles[project]
+        lines = []
         for proj2 in project.dependant_modules:
             if proj2 is None:
-                print("WARNING: Unable to resolve dependency with ID {0} for project {1}".format(id, project.name))
-            else:
-              proj2_id = proj2.get_friendly_id()
-              styling = ""
-              if proj2.highlight or ((project.highlight or project.highlighted_dependents) and proj2.highlighted_dependents) or proj2.has_declared_highlighted_dependencies() or (highlight_all and proj2.has_highlighted_dependencies()):
-                  styling = " [color=\"#30c2c2\"]"
-              elif proj2.is_missing_module or (project.has_missing_modules and proj2.has_missing_modules):
-                  styling = " [color=\"#f22430\"]"
-              elif project.has_circular_dependencies and proj2.has_circular_dependencies:
-                  styling = " [color=\"#ff0000\"]"
-              lines.append("    {0} -> {1}{2}".format(proj1_id, proj2_id, styling))
-
-    lines.append("")
-    lines.append("}")
+                print("WARNING: Unable to resolve dependency for project {0}".format(project.name))
+                continue
 
-    return "\n".join(lines)
+            proj2_style = styles[proj2]
+            styling = edge_stylings[get_edge_style(proj1_style, proj2_style)]
+            lines.append("    {0} -> {1}{2}\n".format(proj1_style[0], proj2_style[0], styling))
+        f.write("".join(lines))
 
+    f.write("\n}")
 
-def process(root_dir, dot_file, exclude, highlight, highlight_all, highlight_children, keep_deps):
-    set_working_basedir(root_dir)
-    module_files = get_tsfiles_in_dir(root_dir)
-    modules = get_modules(module_files)
 
-    if exclude:
-        debug("Excluding projects...")
-        excluder = re.compile(str.lower(exclude))
-        modules = filter_modules(excluder, modules)
+def render_dot_file(projects, highlight_all=False, highlight_children=False, reachability=None):
+    import io
 
-    # pull in dependencies declared in TS-files.
-    # requires real files, so cannot be used in test!
-    for module in modules:
-        module.apply_declared_module_dependencies()
+    f = io.StringIO()
+    write_dot_file(f, projects, highlight_all, highlight_children, reachability)
+    return f.getvalue()
+
+
+class ModuleGroup(object):
+    """
+    A directory of modules, as one node of a collapsed graph.
+
+    dependencies maps every other group this group imports from to the
+    number of imports. The flags are set if they are set on any module in
+    the group, except is_missing_module, which is only set if all of them
+    are missing.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.modules = []
+        self.dependencies = {}
+        self.is_missing_module = True
+        self.has_missing_modules = False
+        self.has_circular_dependencies = False
+        self.highlight = False
+        self.highlighted_dependents = False
+
+    def add(self, module):
+        self.modules.append(module)
+        self.is_missing_module = self.is_missing_module and module.is_missing_module
+        self.has_missing_modules = self.has_missing_modules or module.has_missing_modules or module.is_missing_module
+        self.has_circular_dependencies = self.has_circular_dependencies or module.has_circular_dependencies
+        self.highlight = self.highlight or module.highlight
+        self.highlighted_dependents = self.highlighted_dependents or module.highlighted_dependents
+
+    def get_friendly_id(self):
+        return "dir_" + self.name.replace(".", "_").replace("-", "_").replace("/", "_").replace("@", "_")
+
+
+def get_group_name(name, depth=0):
+    # npm-modules are grouped as themselves.
+    if name.find("/") == -1:
+        return name
+
+    # absolute names (unresolved imports) keep their leading "/", but it
+    # doesn't count as a part of the directory.
+    root = "/" if name.startswith("/") else ""
+    directory = name[len(root):].rsplit("/", 1)[0]
+    if depth > 0:
+        directory = "/".join(directory.split("/")[:depth])
+    return root + directory
+
+
+def collapse_modules(projects, depth=0):
+    """
+    Collapses modules into their directories, or the first depth parts of
+    them. Returns the ModuleGroups, sorted by name. Imports between
+    groups are counted, using declared dependencies, so that transitive
+    dependency elimination doesn't change the counts. Imports of modules
+    not in projects are ignored.
+    """
+    groups = {}
+    group_of = {}
+    for project in projects:
+        name = get_group_name(project.name, depth)
+        group = groups.get(name)
+        if group is None:
+            group = groups[name] = ModuleGroup(name)
+        group.add(project)
+        group_of[project] = group
+
+    for project in projects:
+        group = group_of[project]
+        for dep in project.declared_dependant_modules:
+            dep_group = group_of.get(dep)
+            if dep_group is None or dep_group is group:
+                continue
+            group.dependencies[dep_group] = group.dependencies.get(dep_group, 0) + 1
+
+    result = list(groups.values())
+    sort_modules(result)
+    debug("Info: Collapsed {0} projects into {1} directories.".format(len(projects), len(result)))
+    return result
+
+
+def write_collapsed_dot_file(f, groups, clusters=False):
+    """
+    Writes a graph of ModuleGroups as a DOT-file to the file-object f.
+    Edges are labelled with the number of imports. With clusters, groups
+    are drawn inside a cluster for their parent directory.
+    """
+    f.write(dot_file_header)
+
+    def get_node(group):
+        styling = ""
+        if group.highlight or group.highlighted_dependents:
+            styling = highlighted_node_styling
+        elif group.is_missing_module:
+            styling = missing_node_styling
+        elif group.has_missing_modules:
+            styling = has_missing_node_styling
+        elif group.has_circular_dependencies:
+            styling = circular_node_styling
+        return "{0} [ label=\"{1} ({2})\" {3} ]\n".format(group.get_friendly_id(), group.name, len(group.modules), styling)
+
+    if clusters:
+        parents = {}
+        for group in groups:
+            parent = group.name.rsplit("/", 1)[0] if group.name.find("/") != -1 else ""
+            parents.setdefault(parent, []).append(group)
+
+        for parent in sorted(parents):
+            if not parent:
+                for group in parents[parent]:
+                    f.write("    " + get_node(group))
+                continue
+            f.write("    subgraph cluster_{0} {{\n".format(parent.replace(".", "_").replace("-", "_").replace("/", "_").replace("@", "_")))
+            f.write("        label=\"{0}\" color=\"#888888\" fontcolor=\"#888888\"\n".format(parent))
+            for group in parents[parent]:
+                f.write("        " + get_node(group))
+            f.write("    }\n")
+    else:
+        for group in groups:
+            f.write("    " + get_node(group))
+
+    f.write("\n    # directory dependencies\n")
+    for group in groups:
+        lines = []
+        for dep in sorted(group.dependencies, key=lambda x: x.name):
+            styling = ""
+            if dep.highlight or (group.highlight and dep.highlighted_dependents):
+                styling = " color=\"#30c2c2\""
+            elif dep.is_missing_module or (group.has_missing_modules and dep.has_missing_modules):
+                styling = " color=\"#f22430\""
+            elif group.has_circular_dependencies and dep.has_circular_dependencies:
+                styling = " color=\"#ff0000\""
+            lines.append("    {0} -> {1} [label=\"{2}\"{3}]\n".format(group.get_friendly_id(), dep.get_friendly_id(), group.dependencies[dep], styling))
+        f.write("".join(lines))
+
+    f.write("\n}")
+
+
+def get_node_attributes(style):
+    _, highlighted, _, _, is_missing, has_missing, circular = style
+    return highlighted, is_missing, has_missing, circular
+
+
+def write_jsonl_file(f, projects, highlight_all=False, highlight_children=False, reachability=None):
+    """
+    Writes the graph to the file-object f as JSON Lines: one object per
+    module, followed by one object per dependency.
+    """
+    styles = get_node_styles(projects, highlight_all, reachability)
 
-    process_modules(modules)
+    for project in projects:
+        highlighted, is_missing, has_missing, circular = get_node_attributes(styles[project])
+        f.write(json.dumps({
+            "type": "node",
+            "id": project.name,
+            "highlighted": highlighted,
+            "missing": is_missing,
+            "has_missing": has_missing,
+            "circular": circular,
+        }) + "\n")
+
+    for project in projects:
+        lines = []
+        for dep in project.dependant_modules:
+            lines.append(json.dumps({
+                "type": "edge",
+                "source": project.name,
+                "target": dep.name,
+                "style": get_edge_style(styles[project], styles[dep]),
+            }) + "\n")
+        f.write("".join(lines))
+
+
+graphml_header = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="highlighted" for="node" attr.name="highlighted" attr.type="boolean"/>
+  <key id="missing" for="node" attr.name="missing" attr.type="boolean"/>
+  <key id="has_missing" for="node" attr.name="has_missing" attr.type="boolean"/>
+  <key id="circular" for="node" attr.name="circular" attr.type="boolean"/>
+  <key id="style" for="edge" attr.name="style" attr.type="string"/>
+  <graph id="tsviz" edgedefault="directed">
+"""
+
+
+def write_graphml_file(f, projects, highlight_all=False, highlight_children=False, reachability=None):
+    """
+    Writes the graph to the file-object f as GraphML, one module at a time.
+    """
+    from xml.sax.saxutils import escape, quoteattr
+
+    styles = get_node_styles(projects, highlight_all, reachability)
+
+    f.write(graphml_header)
+    keys = ("highlighted", "missing", "has_missing", "circular")
+    for project in projects:
+        data = "".join(
+            "<data key=\"{0}\">{1}</data>".format(key, str(value).lower())
+            for key, value in zip(keys, get_node_attributes(styles[project]))
+        )
+        f.write("    <node id={0}>{1}</node>\n".format(quoteattr(project.name), data))
+
+    for project in projects:
+        lines = []
+        for dep in project.dependant_modules:
+            lines.append("    <edge source={0} target={1}><data key=\"style\">{2}</data></edge>\n".format(
+                quoteattr(project.name), quoteattr(dep.name), escape(get_edge_style(styles[project], styles[dep]))
+            ))
+        f.write("".join(lines))
+
+    f.write("  </graph>\n</graphml>\n")
+
+
+def write_csv_file(f, projects, highlight_all=False, highlight_children=False, reachability=None):
+    """
+    Writes the dependencies of the graph to the file-object f as CSV, one
+    line per dependency: source, target and style.
+    """
+    import csv
+
+    styles = get_node_styles(projects, highlight_all, reachability)
+
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(["source", "target", "style"])
+    for project in projects:
+        writer.writerows(
+            [project.name, dep.name, get_edge_style(styles[project], styles[dep])]
+            for dep in project.dependant_modules
+        )
+
+
+# writers for --format. all take the same arguments as write_dot_file().
+output_formats = {
+    "dot": write_dot_file,
+    "jsonl": write_jsonl_file,
+    "graphml": write_graphml_file,
+    "csv": write_csv_file,
+}
+
+
+def analyze_modules(modules, keep_deps=False, highlight=None, why=None, timings=None, loose=None, base_path=None, max_memory=None):
+    """
+    Runs all analysis on modules with declared dependencies applied:
+    resolution, circular dependency detection, transitive dependency
+    elimination (unless keep_deps) and highlighting. Returns the
+    DependencyGraph, whose ReachabilityIndex is only built when needed.
+    Raises MemoryError if the process grows beyond max_memory bytes.
+    """
+    graph = process_modules(modules, timings, loose, base_path)
+    graph.max_memory = max_memory
+
+    reachability = None
+    if why or highlight:
+        with time_phase(timings, "reachability") as phase:
+            reachability = graph.get_reachability()
+            phase["items"] = len(graph.get_components())
+
+    if why:
+        print(explain_dependency(reachability, modules, why[0], why[1]))
 
     if not keep_deps:
         debug("Removing redundant dependencies...")
-        remove_transitive_dependencies(modules)
+        with time_phase(timings, "reduction") as phase:
+            remove_transitive_dependencies(modules, graph)
+            phase["items"] = sum(len(module.dependant_modules) for module in modules)
 
     if highlight:
         debug("Highlighting projects...")
-        highlighter = re.compile(str.lower(highlight))
-        highlight_modules(highlighter, modules)
+        with time_phase(timings, "highlight") as phase:
+            highlighter = re.compile(str.lower(highlight))
+            highlight_modules(highlighter, modules, reachability)
+            phase["items"] = sum(1 for module in modules if module.highlight)
+
+    return graph
+
+
+class Analyzer(object):
+    """
+    Analyzes the modules of one source tree.
+
+    An analyzer owns its configuration and results, and doesn't read or
+    change any module-level settings, so several analyzers can be used at
+    the same time: in threads, or one after another in a long-lived worker
+    process.
+
+    analyze() runs the whole pipeline. find_files(), read() and build()
+    run its parts, for callers keeping sources in memory between runs.
+    """
+
+    def __init__(self, root_dir, exclude=None, highlight=None, highlight_all=False, highlight_children=False, keep_deps=False, loose=False, jobs=1, cache=None, strict=False, use_ignores=True, tsconfig=None, timings=None):
+        self.root_dir = root_dir
+        self.base_path = get_directory(get_unix_path(root_dir))
+        debug("Base-solution dir set to {0}".format(self.base_path))
+        self.excluder = re.compile(str.lower(exclude)) if exclude else None
+        self.highlight = highlight
+        self.highlight_all = highlight_all
+        self.highlight_children = highlight_children
+        self.keep_deps = keep_deps
+        self.loose = loose
+        self.jobs = jobs
+        self.cache = cache
+        self.strict = strict
+        self.use_ignores = use_ignores
+        self.tsconfig = tsconfig
+        self.timings = timings
+
+        # results.
+        self.extension = ".ts"
+        self.sources = []
+        self.modules = []
+        self.external_modules = set()
+        self.graph = None
+        self.groups = None
+        self.clusters = False
+
+    def find_files(self):
+        """
+        Returns the source files of the tree, except the excluded ones.
+        """
+        files, self.extension = find_source_files(self.root_dir, self.excluder, self.use_ignores)
+        return self.filter_files(files)
+
+    def filter_files(self, files):
+        if not self.excluder:
+            return files
 
-    txt = render_dot_file(modules, highlight_all, highlight_children)
+        debug("Excluding projects...")
+        return [
+            file for file in files
+            if not self.excluder.match(str.lower(os.path.abspath(file)))
+        ]
+
+    def read(self, files):
+        """
+        Returns the module-specifiers found in each of files.
+        """
+        specifiers = read_all_module_specifiers(files, self.jobs, self.cache, self.strict)
+        if self.cache is not None and files:
+            debug(self.cache.get_statistics())
+            self.cache.save()
+        return specifiers
+
+    def build(self, files, specifiers, why=None):
+        """
+        Builds and analyzes the module-graph of files, given the
+        module-specifiers found in each. Returns its DependencyGraph.
+        """
+        return self.analyze_modules(self.get_modules(files, specifiers), why)
+
+    def get_modules(self, files, specifiers):
+        with time_phase(self.timings, "parse") as phase:
+            modules = get_modules(files, self.base_path)
+            resolver = ModuleResolver(files, self.tsconfig or find_tsconfig(self.root_dir), module_extension=self.extension)
+            for module, module_specifiers in zip(modules, specifiers):
+                module.apply_module_specifiers(module_specifiers, resolver)
+            self.external_modules = resolver.external
+            phase["items"] = sum(len(module_specifiers) for module_specifiers in specifiers)
+        return modules
+
+    def analyze_modules(self, modules, why=None, max_memory=None):
+        # the modules found in the source tree, in their original order.
+        self.sources = modules[:]
+        self.modules = modules
+        self.graph = analyze_modules(modules, self.keep_deps, self.highlight, why, self.timings, self.loose, self.base_path, max_memory)
+        return self.graph
+
+    @property
+    def reachability(self):
+        # built on first use, since runs without highlights, --why or
+        # queries never need it.
+        if self.graph is None:
+            return None
+        return self.graph.get_reachability()
+
+    def analyze(self, why=None):
+        with time_phase(self.timings, "walk") as phase:
+            files = self.find_files()
+            phase["items"] = len(files)
+
+        # files are read and scanned for imports in one go, possibly in worker
+        # processes, so "read" covers both. "parse" turns the found module
+        # specifiers into declared dependencies.
+        with time_phase(self.timings, "read") as phase:
+            specifiers = self.read(files)
+            phase["items"] = len(specifiers)
+
+        return self.build(files, specifiers, why)
+
+    def analyze_workspace(self, why=None):
+        """
+        Analyzes every package in the workspaces of the package.json in
+        the root directory, and merges them into one graph. Imports of
+        other workspace packages resolve to their modules.
+        """
+        with time_phase(self.timings, "walk") as phase:
+            packages = find_workspace_packages(self.root_dir)
+            phase["items"] = len(packages)
+        debug("Info: Found {0} workspace packages.".format(len(packages)))
+
+        cache_dir = None
+        if self.cache is not None:
+            cache_dir = os.path.join(self.cache.directory, "packages")
+
+        with time_phase(self.timings, "read") as phase:
+            exclude = self.excluder.pattern if self.excluder else None
+            results = read_workspace_packages(packages, self.jobs, exclude, self.extension, self.strict, self.use_ignores, cache_dir)
+            phase["items"] = sum(len(files) for files, _, _ in results)
+        debug("Info: {0} of {1} workspace packages were unchanged.".format(sum(1 for _, _, cached in results if cached), len(results)))
+
+        with time_phase(self.timings, "parse") as phase:
+            # resolved here rather than per package, so imports of other
+            # packages always see their current files.
+            stat_cache = StatCache([file for files, _, _ in results for file in files])
+            modules = []
+            self.external_modules = set()
+            for (_, directory), (files, specifiers, _) in zip(packages, results):
+                resolver = ModuleResolver(None, self.tsconfig or find_tsconfig(directory), stat_cache, self.extension, packages)
+                for module, module_specifiers in zip(get_modules(files, self.base_path), specifiers):
+                    module.apply_module_specifiers(module_specifiers, resolver)
+                    modules.append(module)
+                self.external_modules.update(resolver.external)
+            phase["items"] = sum(len(module_specifiers) for _, specifiers, _ in results for module_specifiers in specifiers)
+
+        return self.analyze_modules(modules, why)
+
+    def check(self, cycles=True, missing=True, fail_fast=False):
+        """
+        Only checks the source tree for circular dependencies and missing
+        modules, without transitive dependency elimination, highlighting
+        or rendering. Returns them as check_modules() does. Imports of
+        npm-modules which don't resolve aren't reported as missing.
+        """
+        with time_phase(self.timings, "walk") as phase:
+            files = self.find_files()
+            phase["items"] = len(files)
+
+        with time_phase(self.timings, "read") as phase:
+            specifiers = self.read(files)
+            phase["items"] = len(specifiers)
+
+        modules = self.get_modules(files, specifiers)
+
+        with time_phase(self.timings, "check") as phase:
+            result = check_modules(modules, cycles, missing, fail_fast, self.loose, self.base_path, self.external_modules)
+            phase["items"] = len(modules)
+        return result
+
+    def analyze_streaming(self, why=None, max_memory=None):
+        """
+        Like analyze(), but reads files while walking the source tree,
+        through a bounded queue of worker-process jobs, and only keeps
+        each file's name and module-specifiers until the graph is built.
+        Raises MemoryError if the process grows beyond max_memory bytes,
+        instead of running until it is killed.
+        """
+        if max_memory is not None and get_current_memory() is None:
+            print("WARNING: Memory use can't be measured on this platform. The memory limit is ignored.")
+
+        with time_phase(self.timings, "read") as phase:
+            walker = walk_source_files(self.root_dir, self.excluder, self.use_ignores, self.extension)
+            extensions = []
+
+            def get_files():
+                for filename, extension in walker:
+                    if not extensions:
+                        extensions.append(extension)
+                    if self.excluder and self.excluder.match(str.lower(os.path.abspath(filename))):
+                        continue
+                    yield filename
+
+            files = []
+            specifiers = []
+            for filename, module_specifiers in stream_module_specifiers(get_files(), self.jobs, self.cache, self.strict):
+                files.append(filename)
+                specifiers.append(module_specifiers)
+                if max_memory is not None and len(files) % 256 == 0:
+                    check_memory(max_memory)
+
+            if extensions:
+                self.extension = extensions[0]
+            elif self.extension != fallback_extension:
+                self.extension = fallback_extension
+            if self.cache is not None and files:
+                debug(self.cache.get_statistics())
+                self.cache.save()
+            phase["items"] = len(files)
+
+        modules = self.get_modules(files, specifiers)
+        del files, specifiers
+        if max_memory is not None:
+            check_memory(max_memory)
+        return self.analyze_modules(modules, why, max_memory)
+
+    def get_metrics(self):
+        """
+        Returns the metrics of the declared module-graph, as computed by
+        get_graph_metrics().
+        """
+        with time_phase(self.timings, "metrics") as phase:
+            metrics = get_graph_metrics(self.graph)
+            phase["items"] = len(metrics["modules"])
+        return metrics
+
+    def explain(self, source, target):
+        return explain_dependency(self.reachability, self.modules, source, target)
+
+    def save_snapshot(self, filename):
+        write_snapshot(filename, get_snapshot(self))
+
+    def load_snapshot(self, snapshot, why=None):
+        """
+        Builds and analyzes the module-graph stored in snapshot, instead of
+        reading the source tree. Returns its DependencyGraph.
+        """
+        with time_phase(self.timings, "load") as phase:
+            modules = self.get_snapshot_modules(snapshot)
+            phase["items"] = len(modules)
+
+        return self.analyze_modules(modules, why)
+
+    def get_snapshot_modules(self, snapshot):
+        self.base_path = snapshot["base_path"]
+        self.extension = snapshot["extension"]
+        filenames = snapshot["filenames"]
+
+        modules = []
+        for index, name in enumerate(snapshot["names"]):
+            filename = filenames[index]
+            if self.excluder and self.excluder.match(str.lower(filename)):
+                continue
+            module = Module(filename, self.base_path)
+            module.name = name
+            module.dependant_module_names = [filenames[dep] for dep in snapshot["dependencies"][index]]
+            modules.append(module)
+        return modules
+
+    def load_changes(self, snapshot, changed_files, why=None):
+        """
+        Builds and analyzes the module-graph stored in snapshot, after
+        reading only changed_files again. These may have been added,
+        modified or removed since the snapshot was taken. Other modules keep
+        the dependencies stored in the snapshot. Returns the DependencyGraph.
+        """
+        with time_phase(self.timings, "load") as phase:
+            modules = self.get_snapshot_modules(snapshot)
+            by_filename = dict((module.filename, module) for module in modules)
+            root = os.path.abspath(self.root_dir)
+
+            removed = set()
+            changed = []
+            for file in changed_files:
+                filename = os.path.abspath(file)
+                module = by_filename.get(filename)
+                if not os.path.isfile(filename):
+                    if module is not None:
+                        debug("Info: Removed {0}".format(file))
+                        removed.add(module)
+                    continue
+
+                if module is None:
+                    if not self.is_source_file(filename):
+                        continue
+                    # named as if found while walking the source tree.
+                    module = Module(os.path.join(self.root_dir, os.path.relpath(filename, root)), self.base_path)
+                    modules.append(module)
+                    by_filename[filename] = module
+                debug("Info: Parsed {0}".format(file))
+                changed.append(module)
+
+            modules = [module for module in modules if module not in removed]
+            phase["items"] = len(modules)
+
+        with time_phase(self.timings, "read") as phase:
+            specifiers = self.read([module.filename for module in changed])
+            phase["items"] = len(specifiers)
+
+        with time_phase(self.timings, "parse") as phase:
+            resolver = ModuleResolver([module.filename for module in modules], self.tsconfig or find_tsconfig(self.root_dir), module_extension=self.extension)
+            for module, module_specifiers in zip(changed, specifiers):
+                module.dependant_module_names = []
+                module.apply_module_specifiers(module_specifiers, resolver)
+            self.external_modules = resolver.external
+            phase["items"] = sum(len(module_specifiers) for module_specifiers in specifiers)
+
+        return self.analyze_modules(modules, why)
+
+    def is_source_file(self, filename):
+        # the files find_source_files() would have found.
+        if not filename.endswith(self.extension):
+            return False
+        if self.excluder and self.excluder.match(str.lower(filename)):
+            return False
+        relative_path = os.path.relpath(filename, os.path.abspath(self.root_dir))
+        if relative_path.startswith(".."):
+            return False
+        if self.use_ignores:
+            for name in relative_path.split(os.sep)[:-1]:
+                if name in ignored_directory_names:
+                    return False
+        return True
+
+    def get_cycles(self):
+        """
+        Returns the names of the modules in each group of circular dependencies.
+        """
+        graph = self.graph
+        return [
+            sorted(graph.modules[node].name for node in component)
+            for component in graph.get_circular_components()
+        ]
+
+    def get_missing_modules(self):
+        """
+        Returns (module name, missing module name) for every dependency
+        which couldn't be resolved, except for npm-modules.
+        """
+        # the filenames the missing modules for npm-modules were given.
+        external = set(os.path.abspath(get_missing_module_id(name)) for name in self.external_modules)
+        return [
+            (module.name, dep.name)
+            for module in self.sources
+            for dep in module.declared_dependant_modules
+            if dep.is_missing_module and dep.filename not in external
+        ]
+
+    def focus(self, expression, depth=1, upstream=True, downstream=True):
+        """
+        Limits the graph to the modules within depth hops of the modules
+        matching expression. Returns the remaining modules.
+        """
+        with time_phase(self.timings, "focus") as phase:
+            self.modules = focus_modules(re.compile(str.lower(expression)), self.modules, depth, upstream, downstream)
+            phase["items"] = len(self.modules)
+        return self.modules
+
+    def collapse(self, depth=0, clusters=False):
+        """
+        Collapses the graph into directories, or the first depth parts of
+        them. Written DOT-files show the directories from then on.
+        Returns the ModuleGroups.
+        """
+        with time_phase(self.timings, "collapse") as phase:
+            self.groups = collapse_modules(self.modules, depth)
+            self.clusters = clusters
+            phase["items"] = len(self.groups)
+        return self.groups
+
+    def write_dot_file(self, f):
+        self.write_file(f)
+
+    def write_file(self, f, format="dot"):
+        """
+        Writes the graph to the file-object f, in one of output_formats.
+        Collapsed graphs can only be written as DOT-files.
+        """
+        with time_phase(self.timings, "render") as phase:
+            if self.groups is not None:
+                if format != "dot":
+                    raise ValueError("Collapsed graphs can only be written as DOT-files, not {0}".format(format))
+                write_collapsed_dot_file(f, self.groups, self.clusters)
+                phase["items"] = len(self.groups)
+            else:
+                output_formats[format](f, self.modules, self.highlight_all, self.highlight_children, self.reachability if self.highlight_all else None)
+                phase["items"] = len(self.modules)
+
+    def render_dot_file(self):
+        if self.groups is not None:
+            import io
+
+            f = io.StringIO()
+            write_collapsed_dot_file(f, self.groups, self.clusters)
+            return f.getvalue()
+        return render_dot_file(self.modules, self.highlight_all, self.highlight_children, self.reachability if self.highlight_all else None)
+
+
+# bump whenever the snapshot-format changes.
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot(analyzer):
+    """
+    Returns the module-graph of an analyzer as a JSON-friendly dict.
+
+    Modules are stored in their original order, with the filenames of
+    their dependencies before resolution, so that loading a snapshot can
+    apply any exclude-, loose- or highlight-settings exactly as a full run
+    would. Filenames are stored once, and referred to by index: module i
+    has filename i, and other dependency names follow after the modules.
+    missing lists the dependencies which didn't resolve to any module
+    when the snapshot was taken.
+    """
+    modules = analyzer.sources
+    filenames = [module.filename for module in modules]
+    ids = dict((filename, index) for index, filename in enumerate(filenames))
+
+    dependencies = []
+    missing = []
+    for module in modules:
+        deps = []
+        for name in module.dependant_module_names:
+            index = ids.get(name)
+            if index is None:
+                index = len(filenames)
+                ids[name] = index
+                filenames.append(name)
+            deps.append(index)
+        dependencies.append(deps)
+        missing.append([
+            index
+            for index, dep in zip(deps, module.declared_dependant_modules)
+            if dep.is_missing_module
+        ])
+
+    return {
+        "format": "tsviz-snapshot",
+        "version": SNAPSHOT_VERSION,
+        "root": analyzer.root_dir,
+        "base_path": analyzer.base_path,
+        "extension": analyzer.extension,
+        "names": [module.name for module in modules],
+        "filenames": filenames,
+        "dependencies": dependencies,
+        "missing": missing,
+    }
+
+
+def open_snapshot(filename, mode):
+    # snapshots of large trees compress well.
+    if filename.endswith(".gz"):
+        import gzip
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
+
+def write_snapshot(filename, snapshot):
+    with open_snapshot(filename, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+
+
+def read_snapshot(filename):
+    with open_snapshot(filename, "r") as f:
+        snapshot = json.load(f)
+
+    if not isinstance(snapshot, dict) or snapshot.get("format") != "tsviz-snapshot":
+        raise ValueError("{0} is not a tsviz snapshot".format(filename))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("{0} is a version {1} snapshot. This version of tsviz reads version {2}".format(filename, snapshot.get("version"), SNAPSHOT_VERSION))
+    return snapshot
+
+
+def load_snapshot(filename, exclude=None, highlight=None, highlight_all=False, highlight_children=False, keep_deps=False, loose=False, why=None, timings=None):
+    """
+    Returns an Analyzer with the module-graph of a snapshot, analyzed using
+    the given settings. The source tree isn't read.
+    """
+    with time_phase(timings, "read") as phase:
+        snapshot = read_snapshot(filename)
+        phase["items"] = len(snapshot["names"])
+
+    analyzer = Analyzer(snapshot["root"], exclude, highlight, highlight_all, highlight_children, keep_deps, loose, timings=timings)
+    analyzer.load_snapshot(snapshot, why)
+    return analyzer
+
+
+def get_changed_files(root_dir, base_ref):
+    """
+    Returns the files in root_dir changed since base_ref, according to git.
+    """
+    import subprocess
+    output = subprocess.check_output(["git", "diff", "--name-only", "--relative", base_ref, "--"], cwd=root_dir)
+    return [os.path.join(root_dir, name) for name in output.decode("utf-8").splitlines() if name]
+
+
+def read_changed_files(filename):
+    # one path per line, as written by git diff --name-only. "-" is stdin.
+    if filename == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(filename, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def get_regressions(base, analyzer):
+    """
+    Compares analyzer to the analyzer of its base graph. Returns the groups
+    of circular dependencies which didn't exist in base, and the missing
+    modules which weren't missing in base.
+    """
+    base_cycles = {}
+    for index, cycle in enumerate(base.get_cycles()):
+        for name in cycle:
+            base_cycles[name] = index
+
+    # a cycle is new if any two of its modules weren't circular in base.
+    new_cycles = []
+    for cycle in analyzer.get_cycles():
+        components = set(base_cycles.get(name) for name in cycle)
+        if len(components) != 1 or None in components:
+            new_cycles.append(cycle)
+
+    base_missing = set(base.get_missing_modules())
+    new_missing = [missing for missing in analyzer.get_missing_modules() if missing not in base_missing]
+    return new_cycles, new_missing
+
+
+def check_changes(snapshot, changed_files, root_dir=None, exclude=None, loose=False, jobs=1, cache=None, strict=False, use_ignores=True, tsconfig=None, timings=None):
+    """
+    Patches the module-graph of a snapshot with changed_files, and returns
+    its Analyzer and the cycles and missing modules it introduced, as
+    returned by get_regressions().
+    """
+    with time_phase(timings, "read") as phase:
+        snapshot = read_snapshot(snapshot)
+        phase["items"] = len(snapshot["names"])
+
+    # transitive dependencies don't affect cycles or missing modules.
+    base = Analyzer(snapshot["root"], exclude, keep_deps=True, loose=loose)
+    base.load_snapshot(snapshot)
+
+    analyzer = Analyzer(root_dir or snapshot["root"], exclude, keep_deps=True, loose=loose, jobs=jobs, cache=cache, strict=strict, use_ignores=use_ignores, tsconfig=tsconfig, timings=timings)
+    analyzer.load_changes(snapshot, changed_files)
+
+    new_cycles, new_missing = get_regressions(base, analyzer)
+    return analyzer, new_cycles, new_missing
+
+
+def get_regression_report(new_cycles, new_missing):
+    lines = []
+    for cycle in new_cycles:
+        # the members of a circular group, not a chain of imports.
+        lines.append("New circular dependency: {0}".format(", ".join(cycle)))
+    for module, missing in new_missing:
+        lines.append("New missing module: {0} imports {1}".format(module, missing))
+    if not lines:
+        lines.append("No new circular dependencies or missing modules.")
+    return "\n".join(lines)
+
+
+def process(root_dir, dot_file, exclude, highlight, highlight_all, highlight_children, keep_deps, why=None, jobs=1, cache=None, strict=False, use_ignores=True, timings=None, tsconfig=None, loose=None, snapshot=None, save_snapshot=None, focus=None, depth=1, focus_direction="both", collapse=None, clusters=False, workspaces=False, output_format="dot", stream=False, max_memory=None):
+    if loose is None:
+        loose = allow_loose_module_match
+    if collapse is not None and output_format != "dot":
+        raise ValueError("Collapsed graphs can only be written as DOT-files, not {0}".format(output_format))
+
+    # when writing the graph to stdout, everything else goes to stderr.
+    output = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr) if dot_file == "-" else contextlib.nullcontext():
+        if snapshot:
+            analyzer = load_snapshot(snapshot, exclude, highlight, highlight_all, highlight_children, keep_deps, loose, why, timings)
+        else:
+            analyzer = Analyzer(root_dir, exclude, highlight, highlight_all, highlight_children, keep_deps, loose, jobs, cache, strict, use_ignores, tsconfig, timings)
+            if workspaces:
+                analyzer.analyze_workspace(why)
+            elif stream or max_memory is not None:
+                analyzer.analyze_streaming(why, max_memory)
+            else:
+                analyzer.analyze(why)
+
+        if save_snapshot:
+            analyzer.save_snapshot(save_snapshot)
+            print("Wrote snapshot '{0}'.".format(save_snapshot))
+
+        if focus:
+            analyzer.focus(focus, depth, focus_direction != "down", focus_direction != "up")
+
+        if collapse is not None:
+            analyzer.collapse(collapse, clusters)
+
+    if not dot_file:
+        return analyzer
+
+    if dot_file == "-":
+        analyzer.write_file(output, output_format)
+        return analyzer
 
     with open(dot_file, 'w') as f:
-        f.write(txt)
+        analyzer.write_file(f, output_format)
 
     print("Wrote output-file '{0}'.".format(dot_file))
+    return analyzer
+
+
+class Watcher(object):
+    """
+    Keeps the parsed imports of a source tree in memory, and regenerates
+    the graph when files are added, changed or removed.
+
+    Only changed files are read and parsed again. When no file was added
+    or removed and the imports of the changed files are the same, the
+    graph can't have changed, and isn't rebuilt at all. Otherwise it is
+    rebuilt from the in-memory imports, and the output-file is only
+    rewritten when the graph actually changed.
+    """
+
+    def __init__(self, root_dir, dot_file, exclude=None, highlight=None, highlight_all=False, highlight_children=False, keep_deps=False, jobs=1, cache=None, strict=False, use_ignores=True, tsconfig=None, loose=None):
+        if loose is None:
+            loose = allow_loose_module_match
+
+        self.analyzer = Analyzer(root_dir, exclude, highlight, highlight_all, highlight_children, keep_deps, loose, jobs, cache, strict, use_ignores, tsconfig)
+        self.dot_file = dot_file
+
+        self.files = []
+        self.stats = {}
+        self.specifiers = {}
+        self.output = None
+        self.imports_changed = True
+
+    def scan(self):
+        """
+        Checks the source tree for changes, and parses changed files.
+        Returns True if anything changed since the last scan.
+        """
+        files = self.analyzer.find_files()
+
+        stats = {}
+        for file in files:
+            try:
+                stat = os.stat(file)
+            except OSError:
+                # removed while we were looking.
+                continue
+            stats[file] = (stat.st_size, stat.st_mtime_ns)
+        files = [file for file in files if file in stats]
+
+        changed = [file for file in files if self.stats.get(file) != stats[file]]
+        removed = [file for file in self.stats if file not in stats]
+
+        for file in removed:
+            debug("Info: Removed {0}".format(file))
+            del self.specifiers[file]
+
+        imports_changed = False
+        for file, specifiers in zip(changed, self.analyzer.read(changed)):
+            debug("Info: Parsed {0}".format(file))
+            if self.specifiers.get(file) != specifiers:
+                imports_changed = True
+            self.specifiers[file] = specifiers
+
+        # file-order matters for module resolution, so always keep the latest.
+        order_changed = files != self.files
+        self.files = files
+        self.stats = stats
+        self.imports_changed = self.imports_changed or imports_changed or bool(removed) or order_changed
+        return bool(changed or removed or order_changed)
+
+    def get_specifiers(self):
+        return [self.specifiers[file] for file in self.files]
+
+    def update(self):
+        """
+        Rebuilds the graph, and writes the output-file if it changed.
+        Returns True if the output-file was written.
+        """
+        if not self.imports_changed and self.output is not None:
+            debug("Info: Imports unchanged.")
+            return False
+
+        self.imports_changed = False
+        self.analyzer.build(self.files, self.get_specifiers())
+        txt = self.analyzer.render_dot_file()
+        if txt == self.output:
+            debug("Info: Graph unchanged.")
+            return False
+
+        with open(self.dot_file, 'w') as f:
+            f.write(txt)
+        self.output = txt
+        print("Wrote output-file '{0}'.".format(self.dot_file))
+        return True
+
+    def run(self, interval=1.0):
+        import time
+
+        try:
+            while True:
+                if self.scan():
+                    self.update()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+class GraphServer(object):
+    """
+    Keeps the module-graph of a source tree warm, and answers queries
+    about it. handle() takes a request path and its query parameters, and
+    returns (status, content-type, body). serve() makes it available over
+    HTTP on localhost.
+
+    Files are only read again when a refresh is requested, and then only
+    the changed ones. Graphs with other exclude- or highlight-settings are
+    built from the imports kept in memory.
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.analyzer = watcher.analyzer
+        self.refresh()
+
+    def refresh(self):
+        self.watcher.scan()
+        if not self.watcher.imports_changed and self.analyzer.graph is not None:
+            return False
+        self.watcher.imports_changed = False
+        self.analyzer.build(self.watcher.files, self.watcher.get_specifiers())
+        return True
+
+    def find_module(self, params, name="module"):
+        expression = params.get(name)
+        if not expression:
+            raise ValueError("Missing parameter '{0}'".format(name))
+        module = find_module(expression, self.analyzer.modules)
+        if module is None:
+            raise LookupError("No module matching {0}".format(expression))
+        return module
+
+    def render(self, params):
+        base = self.analyzer
+        analyzer = Analyzer(
+            base.root_dir,
+            params.get("exclude"),
+            params.get("highlight"),
+            params.get("highlight_all") == "1",
+            base.highlight_children,
+            params.get("keep_deps") == "1",
+            base.loose,
+            strict=base.strict,
+            use_ignores=base.use_ignores,
+            tsconfig=base.tsconfig,
+        )
+        analyzer.extension = base.extension
+        files = analyzer.filter_files(self.watcher.files)
+        analyzer.build(files, [self.watcher.specifiers[file] for file in files])
+        if params.get("focus"):
+            direction = params.get("direction", "both")
+            analyzer.focus(params["focus"], int(params.get("depth", 1)), direction != "down", direction != "up")
+        if params.get("collapse") is not None:
+            analyzer.collapse(int(params["collapse"] or 0), params.get("clusters") == "1")
+        return analyzer.render_dot_file()
+
+    def get_dependencies(self, module, transitive=False):
+        if transitive:
+            modules = self.analyzer.reachability.get_dependencies(module)
+        else:
+            modules = module.declared_dependant_modules
+        return sorted(dep.name for dep in modules if dep is not module)
+
+    def get_dependants(self, module, transitive=False):
+        if transitive:
+            modules = self.analyzer.reachability.get_dependants(module)
+        else:
+            modules = [
+                dependant
+                for dependant in self.analyzer.reachability.graph.modules
+                if module in dependant.declared_dependant_modules
+            ]
+        return sorted(dependant.name for dependant in modules if dependant is not module)
+
+    def handle(self, path, params):
+        try:
+            if path == "/":
+                result = {
+                    "root": self.analyzer.root_dir,
+                    "files": len(self.watcher.files),
+                    "modules": len(self.analyzer.modules),
+                }
+            elif path == "/refresh":
+                result = {"changed": self.refresh()}
+            elif path == "/dot":
+                return 200, "text/vnd.graphviz", self.render(params)
+            elif path == "/cycles":
+                result = self.analyzer.get_cycles()
+            elif path == "/dependencies":
+                result = self.get_dependencies(self.find_module(params), params.get("all") == "1")
+            elif path in ("/dependants", "/dependents"):
+                result = self.get_dependants(self.find_module(params), params.get("all") == "1")
+            elif path == "/why":
+                module = self.find_module(params)
+                dependency = self.find_module(params, "dependency")
+                path = self.analyzer.reachability.get_path(module, dependency)
+                result = None if path is None else [dep.name for dep in path]
+            else:
+                return 404, "application/json", json.dumps({"error": "Unknown request {0}".format(path)})
+        except (ValueError, re.error) as e:
+            return 400, "application/json", json.dumps({"error": str(e)})
+        except LookupError as e:
+            return 404, "application/json", json.dumps({"error": str(e)})
+
+        return 200, "application/json", json.dumps(result)
+
+    def serve(self, port=0, host="127.0.0.1"):
+        """
+        Serves requests over HTTP until interrupted. Port 0 picks a free port.
+        """
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+
+        graph_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+                status, content_type, body = graph_server.handle(url.path, params)
+
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type + "; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                debug(format % args)
+
+        httpd = HTTPServer((host, port), RequestHandler)
+        print("Serving {0} on http://{1}:{2}/".format(self.analyzer.root_dir, host, httpd.server_address[1]))
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
 
 
 def main():
-    global debug_output, allow_loose_module_match
-
     p = ArgumentParser()
     p.add_argument("--input", "-i", help="The root directory to analyze.")
-    p.add_argument("--output", "-o", help="The file to write to.")
+    p.add_argument("--output", "-o", help="The file to write to. - writes to stdout.")
+    p.add_argument("--format", "-f", choices=sorted(output_formats), default="dot", help="Format of the output-file: a DOT-file, JSON Lines, GraphML or a CSV-file of all dependencies. Defaults to dot")
     p.add_argument("--loose", "-l", action="store_true", help="Allow loose matching of modules (may be required with path-aliases!)")
     p.add_argument("--keep-declared-deps", "-k", action="store_true", help="Don't remove redundant, transisitive dependencies in post-processing.")
     p.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
@@ -442,13 +3562,126 @@ def main():
     p.add_argument("--highlight", help="Highlights modules matching this expression in the graph")
     p.add_argument("--highlight-all", action="store_true", help="Highlight all paths leading to a highlighted project")
     p.add_argument("--highlight-children", action="store_true", help="Highlight all child-dependencies of highlighted project")
+    p.add_argument("--workspaces", action="store_true", help="Analyze the packages in the workspaces of package.json in the root directory, and merge them into one graph")
+    p.add_argument("--check-cycles", action="store_true", help="Only check for circular dependencies, without writing a graph. Exits with {0} if there are any".format(check_exit_cycles))
+    p.add_argument("--check-missing", action="store_true", help="Only check for missing modules, without writing a graph. Exits with {0} if there are any".format(check_exit_missing))
+    p.add_argument("--fail-fast", action="store_true", help="With --check-cycles or --check-missing, stop at the first problem found")
+    p.add_argument("--focus", metavar="REGEX", help="Only graph the modules matching this expression, and the modules within --depth dependencies of them")
+    p.add_argument("--depth", type=int, default=1, help="Number of dependencies to follow from the modules matching --focus. Defaults to 1")
+    p.add_argument("--focus-direction", choices=["both", "up", "down"], default="both", help="Follow dependants (up), dependencies (down) or both from the modules matching --focus. Defaults to both")
+    p.add_argument("--collapse", type=int, nargs="?", const=0, metavar="DEPTH", help="Graph directories instead of modules, with the number of imports between them. With DEPTH, only the first DEPTH parts of each directory are used")
+    p.add_argument("--clusters", action="store_true", help="With --collapse, draw directories inside a cluster for their parent directory")
+    p.add_argument("--jobs", "-j", type=int, default=1, help="Number of worker processes used to parse files. 0 uses one per CPU.")
+    p.add_argument("--stream", action="store_true", help="Read files while walking the source tree, keeping only their imports in memory. Uses less memory on large trees")
+    p.add_argument("--max-memory", type=int, metavar="MB", help="Stop with an error if more than MB megabytes of memory is used. Only the peak is measured where /proc isn't available. Implies --stream")
+    p.add_argument("--strict-imports", action="store_true", help="Only look for imports at the top of each file. Faster, but misses require() and import()")
+    p.add_argument("--cache-dir", help="Directory to keep the parse-cache in. Defaults to {0} in the root directory.".format(cache_directory_name))
+    p.add_argument("--no-cache", action="store_true", help="Don't use the parse-cache")
+    p.add_argument("--clear-cache", action="store_true", help="Clear the parse-cache before running")
+    p.add_argument("--watch", "-w", action="store_true", help="Keep running, and update the output-file when source files change")
+    p.add_argument("--watch-interval", type=float, default=1.0, help="Seconds between checking for changes in watch-mode")
+    p.add_argument("--serve", action="store_true", help="Keep the graph in memory, and answer queries about it over HTTP on localhost")
+    p.add_argument("--port", type=int, default=8421, help="Port to serve on. Defaults to 8421")
+    p.add_argument("--snapshot", metavar="FILE", help="Load the module-graph from a snapshot, instead of reading the source tree")
+    p.add_argument("--save-snapshot", metavar="FILE", help="Save the module-graph to a snapshot, which can be loaded with --snapshot. Compressed if FILE ends with .gz")
+    p.add_argument("--base", metavar="SNAPSHOT", help="Only re-read the files given by --changed or --changed-since, and report circular dependencies and missing modules not in the SNAPSHOT. Exits with 1 if there are any")
+    p.add_argument("--changed", metavar="FILE", help="File listing the changed files, one per line, as written by git diff --name-only. - reads from stdin")
+    p.add_argument("--changed-since", metavar="REF", help="Use the files changed since the git REF")
+    p.add_argument("--tsconfig", help="tsconfig.json to read baseUrl and paths from. Defaults to the one in the root directory, if any")
+    p.add_argument("--no-ignore", action="store_true", help="Also look for sources in node_modules, dist, .git and paths ignored by .gitignore")
+    p.add_argument("--timings", action="store_true", help="Report time, memory use and item counts for each phase of the run. Not supported in watch-mode")
+    p.add_argument("--timings-json", metavar="FILE", help="Write the metrics of each phase of the run to FILE as JSON")
+    p.add_argument("--profile", metavar="FILE", help="Run under cProfile, and write the profile to FILE")
+    p.add_argument("--metrics", action="store_true", help="Report fan-in, fan-out, transitive dependencies and dependants, layers and circular groups, with the top modules for each")
+    p.add_argument("--metrics-json", metavar="FILE", help="Write the metrics of every module to FILE as JSON")
+    p.add_argument("--top", type=int, default=10, help="Number of modules listed per metric in the --metrics report. Defaults to 10")
+    p.add_argument("--why", nargs=2, metavar=("MODULE", "DEPENDENCY"), help="Show the shortest chain of imports through which MODULE depends on DEPENDENCY")
 
     args = p.parse_args()
-
-    debug_output = args.verbose
-    allow_loose_module_match = args.loose
-
-    process(args.input, args.output, args.exclude, args.highlight, args.highlight_all, args.highlight_children, args.keep_declared_deps)
+    if args.collapse is not None and args.format != "dot":
+        p.error("--collapse can only be written with --format dot")
+
+    if args.verbose:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.DEBUG)
+
+    # with -o -, stdout only gets the graph, and reports go to stderr.
+    reports = sys.stderr if args.output == "-" else sys.stdout
+
+    jobs = args.jobs
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    cache = None
+    if not args.no_cache and not args.snapshot and args.input:
+        cache_dir = args.cache_dir or os.path.join(args.input, cache_directory_name)
+        cache = ParseCache(cache_dir, args.strict_imports)
+        if args.clear_cache:
+            cache.clear()
+
+    timings = None
+    if args.timings or args.timings_json:
+        timings = PhaseTimings()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    exit_code = 0
+    try:
+        if args.base:
+            if args.changed_since:
+                changed_files = get_changed_files(args.input or read_snapshot(args.base)["root"], args.changed_since)
+            else:
+                changed_files = read_changed_files(args.changed or "-")
+            analyzer, new_cycles, new_missing = check_changes(args.base, changed_files, args.input, args.exclude, args.loose, jobs, cache, args.strict_imports, not args.no_ignore, args.tsconfig, timings)
+            print(get_regression_report(new_cycles, new_missing))
+            if new_cycles or new_missing:
+                exit_code = 1
+            if args.save_snapshot:
+                analyzer.save_snapshot(args.save_snapshot)
+                print("Wrote snapshot '{0}'.".format(args.save_snapshot))
+        elif args.check_cycles or args.check_missing:
+            analyzer = Analyzer(args.input, args.exclude, loose=args.loose, jobs=jobs, cache=cache, strict=args.strict_imports, use_ignores=not args.no_ignore, tsconfig=args.tsconfig, timings=timings)
+            cycles, missing = analyzer.check(args.check_cycles, args.check_missing, args.fail_fast)
+            print(get_check_report(cycles, missing))
+            exit_code = get_check_exit_code(cycles, missing)
+        elif args.serve:
+            watcher = Watcher(args.input, None, args.exclude, args.highlight, args.highlight_all, args.highlight_children, args.keep_declared_deps, jobs, cache, args.strict_imports, not args.no_ignore, args.tsconfig, args.loose)
+            GraphServer(watcher).serve(args.port)
+        elif args.watch:
+            watcher = Watcher(args.input, args.output, args.exclude, args.highlight, args.highlight_all, args.highlight_children, args.keep_declared_deps, jobs, cache, args.strict_imports, not args.no_ignore, args.tsconfig, args.loose)
+            watcher.run(args.watch_interval)
+        else:
+            try:
+                analyzer = process(args.input, args.output, args.exclude, args.highlight, args.highlight_all, args.highlight_children, args.keep_declared_deps, args.why, jobs, cache, args.strict_imports, not args.no_ignore, timings, args.tsconfig, args.loose, args.snapshot, args.save_snapshot, args.focus, args.depth, args.focus_direction, args.collapse, args.clusters, args.workspaces, args.format, args.stream, args.max_memory * 1024 * 1024 if args.max_memory else None)
+            except MemoryError as e:
+                print("ERROR! {0}".format(e), file=reports)
+                exit_code = 1
+            else:
+                if args.metrics or args.metrics_json:
+                    metrics = analyzer.get_metrics()
+                    if args.metrics:
+                        print(get_metrics_report(metrics, args.top), file=reports)
+                    if args.metrics_json:
+                        with open(args.metrics_json, "w") as f:
+                            json.dump(metrics, f)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print("Wrote profile to '{0}'.".format(args.profile), file=reports)
+
+    if timings is not None:
+        if args.timings:
+            print(timings.get_report(), file=reports)
+        if args.timings_json:
+            timings.save(args.timings_json)
+
+    if exit_code:
+        sys.exit(exit_code)
 
 
 # don't run from unit-tests